@@ -1,4 +1,7 @@
 from pathlib import Path
+import hashlib
+import pickle
+import pyarrow.parquet as pq
 
 class PathConfig:
     def __init__(self):
@@ -19,10 +22,52 @@ class PathConfig:
         
         self.PROCESSED_DIR = Path("data/processed")
         self.MODELS_DIR = Path("models")
+        self.META_CACHE_DIR = Path(".parquet_meta_cache")
+        self.DATA_CACHE_DIR = self.PROCESSED_DIR / "_cache"
+        
+        self._metadata_cache = {}
         
     def ensure_directories(self):
         """Создание необходимых директорий"""
         self.PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
         self.MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    
+    def get_cached_metadata(self, path) -> pq.FileMetaData:
+        """Метаданные parquet-файла (схема, row groups) с кэшем на диске.
+        
+        Запись инвалидируется, если у файла изменились mtime или размер.
+        """
+        path = Path(path)
+        stat = path.stat()
+        file_key = (stat.st_mtime_ns, stat.st_size)
+        
+        # Кэш в памяти процесса
+        cached = self._metadata_cache.get(path)
+        if cached and cached[0] == file_key:
+            return cached[1]
+        
+        # Кэш на диске (общий для всех запусков)
+        cache_file = self.META_CACHE_DIR / f"{hashlib.md5(str(path.resolve()).encode()).hexdigest()}.pkl"
+        if cache_file.exists():
+            try:
+                with open(cache_file, 'rb') as f:
+                    cached = pickle.load(f)
+                if cached[0] == file_key:
+                    self._metadata_cache[path] = cached
+                    return cached[1]
+            except Exception:
+                pass
+        
+        metadata = pq.read_metadata(path)
+        self._metadata_cache[path] = (file_key, metadata)
+        
+        try:
+            self.META_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            with open(cache_file, 'wb') as f:
+                pickle.dump((file_key, metadata), f)
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить кэш метаданных {path}: {e}")
+        
+        return metadata
 
-PATHS = PathConfig()
\ No newline at end of file
+PATHS = PathConfig()
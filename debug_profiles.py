@@ -4,7 +4,7 @@ from pathlib import Path
 import polars as pl
 
 # Добавляем корневую директорию в путь
-sys.path.append(str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
 
 from src.data_processor import DataProcessor
 from src.user_profiler import UserProfiler
@@ -16,37 +16,49 @@ def debug_profile_creation():
     
     # Загрузка данных
     processor = DataProcessor()
-    data = processor.load_all_data(sample_fraction=0.01)
+    data = processor.scan_all_data(sample_fraction=0.01)
     
     if not data:
         print("❌ Не удалось загрузить данные")
         return
     
+    # Читаем только колонки, нужные для диагностики пользователей
+    columns = {name: frame.collect_schema().names() for name, frame in data.items()}
+    users_df = data['users'].select(['uid', 'user_id']).collect()
+    events_df = data['retail_events'].select(['uid', 'user_id', 'action_type']).collect()
+    items_count = data['retail_items'].select(pl.len()).collect().item()
+    
     print("\n📊 АНАЛИЗ ДАННЫХ:")
-    print(f"👥 Пользователи: {data['users'].shape}")
-    print(f"🛍️ Товары: {data['retail_items'].shape}")
-    print(f"📊 События: {data['retail_events'].shape}")
+    print(f"👥 Пользователи: {(users_df.height, len(columns['users']))}")
+    print(f"🛍️ Товары: {(items_count, len(columns['retail_items']))}")
+    print(f"📊 События: {(events_df.height, len(columns['retail_events']))}")
     
     # Проверим структуру данных
     print(f"\n🔍 СТРУКТУРА ДАННЫХ:")
-    print(f"Колонки users: {data['users'].columns}")
-    print(f"Колонки events: {data['retail_events'].columns}")
-    print(f"Колонки items: {data['retail_items'].columns}")
+    print(f"Колонки users: {columns['users']}")
+    print(f"Колонки events: {columns['retail_events']}")
+    print(f"Колонки items: {columns['retail_items']}")
     
     # Проверим пересечение пользователей
     try:
-        event_users = data['retail_events']['user_id'].unique()
-        all_users = data['users']['user_id']
+        event_users = events_df['user_id'].unique()
+        all_users = users_df['user_id']
         
         print(f"\n🔗 ПЕРЕСЕЧЕНИЕ ПОЛЬЗОВАТЕЛЕЙ:")
         print(f"   Всего пользователей: {all_users.len()}")
         print(f"   Пользователей в событиях: {event_users.len()}")
         
-        # Найдем общих пользователей
-        common_users = set(all_users).intersection(set(event_users))
-        print(f"   Общих пользователей: {len(common_users)}")
+        # Найдем общих пользователей (semi-join без материализации Python-множеств)
+        common_users = (
+            users_df.lazy()
+            .join(events_df.lazy().select('uid').unique(), on='uid', how='semi')
+            .select(pl.len())
+            .collect()
+            .item()
+        )
+        print(f"   Общих пользователей: {common_users}")
         
-        if len(common_users) == 0:
+        if common_users == 0:
             print("   ⚠️ НЕТ ОБЩИХ ПОЛЬЗОВАТЕЛЕЙ! Это основная проблема.")
             print("   Возможные причины:")
             print("   - Разные наборы user_id в users.pq и events")
@@ -60,27 +72,34 @@ def debug_profile_creation():
     print(f"\n👤 ПРОВЕРКА КОНКРЕТНЫХ ПОЛЬЗОВАТЕЛЕЙ:")
     
     # Возьмем первых 5 пользователей из users
-    sample_user_ids = data['users']['user_id'].head(5).to_list()
+    sample_user_ids = users_df['user_id'].head(5).to_list()
     print(f"   Пример user_id из users: {sample_user_ids}")
     
-    # Проверим есть ли они в событиях
+    # Проверим есть ли они в событиях (один проход по событиям)
+    event_counts = dict(
+        events_df
+        .filter(pl.col('user_id').is_in(sample_user_ids))
+        .group_by('user_id')
+        .len()
+        .iter_rows()
+    )
     for user_id in sample_user_ids:
-        user_events = data['retail_events'].filter(pl.col('user_id') == user_id)
-        print(f"   User {user_id}: {user_events.height} событий")
+        print(f"   User {user_id}: {event_counts.get(user_id, 0)} событий")
     
     # Проверим первые 5 user_id из событий
-    sample_event_users = data['retail_events']['user_id'].head(5).to_list()
+    sample_event_users = events_df['user_id'].head(5).to_list()
     print(f"   Пример user_id из events: {sample_event_users}")
     
     # Проверим структуру событий
     print(f"\n📋 СТРУКТУРА СОБЫТИЙ:")
-    if data['retail_events'].height > 0:
-        sample_event = data['retail_events'].head(1)
+    if events_df.height > 0:
+        # Широкий фрейм событий нужен только для одной строки примера
+        sample_event = data['retail_events'].head(1).collect()
         print(f"   Пример события: {sample_event.row(0)}")
         
         # Проверим action_type
-        if 'action_type' in data['retail_events'].columns:
-            action_counts = data['retail_events']['action_type'].value_counts()
+        if 'action_type' in events_df.columns:
+            action_counts = events_df['action_type'].value_counts()
             print(f"   Типы действий: {action_counts.to_dicts()}")
 
 if __name__ == "__main__":
@@ -3,11 +3,12 @@ import sys
 from pathlib import Path
 import polars as pl
 import numpy as np
+import orjson
 from datetime import datetime
 
-sys.path.append(str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
 
-from src.data_processor import DataProcessor
+from src.data_processor import DataProcessor, ITEM_COLUMNS
 from src.category_discovery import CategoryDiscoverer
 from src.user_profiler import UserProfiler
 from src.product_matcher import ProductMatcher
@@ -21,7 +22,7 @@ def run_fixed_pipeline():
     # 1. Загрузка данных
     print("\n1. 📊 ЗАГРУЗКА ДАННЫХ")
     processor = DataProcessor()
-    data = processor.load_all_data(sample_fraction=0.01)
+    data = processor.scan_all_data(sample_fraction=0.01, synth_prices=True)
     
     if not data:
         print("❌ Не удалось загрузить данные")
@@ -29,26 +30,20 @@ def run_fixed_pipeline():
     
     # КРИТИЧЕСКИЙ ФИКС: используем только пользователей из событий
     print("\n🔧 ПРИМЕНЕНИЕ ФИКСА ДЛЯ ПОЛЬЗОВАТЕЛЕЙ...")
-    event_users = data['retail_events']['user_id'].unique()
-    print(f"   Найдено пользователей в событиях: {event_users.len()}")
+    # Выборка событий читается один раз; пользователи и профили строятся по одному и тому же фрейму
+    data['retail_events'] = data['retail_events'].collect()
+    event_users = data['retail_events'].select(['uid', 'user_id']).unique(subset='uid')
+    print(f"   Найдено пользователей в событиях: {event_users.height}")
     
     # Создаем корректный users_df
-    data['users'] = pl.DataFrame({'user_id': event_users}).with_columns([
+    data['users'] = event_users.lazy().with_columns([
         pl.lit('cluster_1').alias('socdem_cluster'),
         pl.lit('region_1').alias('region')
     ])
     
-    # Фикс для цен
+    # Фикс для цен (price_fixed добавлен при сканировании, embedding не читаем)
     if 'retail_items' in data:
-        items_df = data['retail_items']
-        data['retail_items'] = items_df.with_columns([
-            pl.col('price').alias('price_original'),
-            # Создаем реалистичные цены
-            pl.when(pl.col('category').is_not_null())
-             .then((pl.col('category').hash() % 9000) + 1000)
-             .otherwise(2000)
-             .alias('price_fixed')
-        ])
+        data['retail_items'] = data['retail_items'].select(ITEM_COLUMNS + ['price_original', 'price_fixed']).collect()
         print("   Применен фикс для цен")
     
     # 2. Обнаружение категорий
@@ -92,16 +87,18 @@ def run_fixed_pipeline():
     output_dir.mkdir(exist_ok=True)
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    profiles_path, recs_path, categories_path, metrics_path = (
+        output_dir / f"{name}_{timestamp}.{ext}"
+        for name, ext in (('user_profiles', 'parquet'), ('recommendations', 'parquet'),
+                          ('categories', 'json'), ('metrics', 'json'))
+    )
     
-    user_profiles.write_parquet(output_dir / f"user_profiles_{timestamp}.parquet")
-    recommendations.write_parquet(output_dir / f"recommendations_{timestamp}.parquet")
-    
-    import json
-    with open(output_dir / f"categories_{timestamp}.json", 'w', encoding='utf-8') as f:
-        json.dump(categories, f, ensure_ascii=False, indent=2)
+    user_profiles.write_parquet(profiles_path)
+    recommendations.write_parquet(recs_path)
     
-    with open(output_dir / f"metrics_{timestamp}.json", 'w', encoding='utf-8') as f:
-        json.dump(metrics, f, ensure_ascii=False, indent=2)
+    json_options = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    categories_path.write_bytes(orjson.dumps(categories, option=json_options))
+    metrics_path.write_bytes(orjson.dumps(metrics, option=json_options))
     
     # 7. Вывод результатов
     print("\n7. 📊 РЕЗУЛЬТАТЫ")
@@ -112,7 +109,9 @@ def run_fixed_pipeline():
     
     # Примеры рекомендаций
     print(f"\n📋 ПРИМЕРЫ РЕКОМЕНДАЦИЙ:")
-    for i, rec in enumerate(recommendations.head(5).iter_rows(named=True)):
+    preview_columns = [c for c in ('user_id', 'product_name', 'match_score', 'final_score')
+                       if c in recommendations.columns]
+    for i, rec in enumerate(recommendations.head(5).select(preview_columns).to_dicts()):
         print(f"   {i+1}. 👤 {rec['user_id']} → {rec['product_name']}")
         print(f"       Score: {rec.get('match_score', 0):.3f}, Final: {rec.get('final_score', 0):.3f}")
     
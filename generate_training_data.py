@@ -1,9 +1,17 @@
 import polars as pl
-import json
+import numpy as np
+import orjson
+from pathlib import Path
 from typing import List, Dict
-import random
 from datetime import datetime, timedelta
 
+# Диапазоны конверсии (low, high) для уровней совместимости профиля и продукта
+CONVERSION_TIERS = np.array([
+    [0.6, 0.9],  # 0: высокий/очень высокий уровень трат + премиум/инвестиции
+    [0.4, 0.7],  # 1: средний уровень трат + кредитки/сбережения
+    [0.1, 0.4],  # 2: остальные сочетания
+])
+
 def generate_historical_training_data() -> List[Dict]:
     """Генерация синтетических данных для обучения ML модели"""
     print("🤖 Генерация тренировочных данных для ML...")
@@ -25,15 +33,22 @@ def generate_historical_training_data() -> List[Dict]:
         {'id': 'investment_1', 'business_value': 0.85, 'type': 'investment'},
     ]
     
-    for user in user_profiles:
-        for product in products:
-            # Имитируем разную конверсию в зависимости от профиля и продукта
-            if user['spending_level'] in ['high', 'very_high'] and product['type'] in ['premium_cards', 'investment']:
-                conversion_rate = random.uniform(0.6, 0.9)
-            elif user['spending_level'] == 'medium' and product['type'] in ['credit_cards', 'savings']:
-                conversion_rate = random.uniform(0.4, 0.7)
-            else:
-                conversion_rate = random.uniform(0.1, 0.4)
+    # Матрица уровней совместимости (n_users, n_products)
+    spending = np.array([user['spending_level'] for user in user_profiles])[:, None]
+    product_types = np.array([product['type'] for product in products])[None, :]
+    
+    tiers = np.where(
+        np.isin(spending, ['high', 'very_high']) & np.isin(product_types, ['premium_cards', 'investment']), 0,
+        np.where((spending == 'medium') & np.isin(product_types, ['credit_cards', 'savings']), 1, 2)
+    ).astype(np.int8)
+    
+    # Имитируем разную конверсию в зависимости от профиля и продукта — одним вызовом
+    rng = np.random.default_rng()
+    conversion_rates = rng.uniform(CONVERSION_TIERS[tiers, 0], CONVERSION_TIERS[tiers, 1])
+    
+    for i, user in enumerate(user_profiles):
+        for j, product in enumerate(products):
+            conversion_rate = float(conversion_rates[i, j])
             
             training_data.append({
                 'user_profile': user,
@@ -49,12 +64,34 @@ def generate_historical_training_data() -> List[Dict]:
     print(f"✅ Сгенерировано {len(training_data)} тренировочных примеров")
     return training_data
 
-def save_training_data(data: List[Dict], filename: str = "training_data.json"):
-    """Сохранение тренировочных данных"""
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def flatten_training_data(data: List[Dict]) -> pl.DataFrame:
+    """Плоская таблица тренировочных данных: вложенные словари -> колонки верхнего уровня"""
+    return pl.DataFrame([
+        {
+            'user_spending_level': record['user_profile']['spending_level'],
+            'user_interaction_frequency': record['user_profile']['interaction_frequency'],
+            'user_total_spent': record['user_profile']['total_spent'],
+            'product_id': record['product']['id'],
+            'product_business_value': record['product']['business_value'],
+            'product_type': record['product']['type'],
+            'conversion_rate': record['conversion_rate'],
+            'converted': record['converted'],
+            'llm_price_segment': record['llm_insights']['price_segment'],
+            'llm_spending_impact': record['llm_insights']['spending_impact']
+        }
+        for record in data
+    ])
+
+def save_training_data(data: List[Dict], filename: str = "training_data.parquet"):
+    """Сохранение тренировочных данных в Parquet"""
+    flatten_training_data(data).write_parquet(filename, compression='zstd', statistics=True)
+    print(f"💾 Тренировочные данные сохранены в {filename}")
+
+def save_training_data_json(data: List[Dict], filename: str = "training_data.json"):
+    """Сохранение тренировочных данных в JSON (для отладки)"""
+    Path(filename).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
     print(f"💾 Тренировочные данные сохранены в {filename}")
 
 if __name__ == "__main__":
     training_data = generate_historical_training_data()
-    save_training_data(training_data)
\ No newline at end of file
+    save_training_data(training_data)
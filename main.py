@@ -1,9 +1,11 @@
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import polars as pl  # ДОБАВЬТЕ ЭТУ СТРОКУ
 
 # Добавляем корневую директорию в путь
-sys.path.append(str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
 
 from src.data_processor import DataProcessor
 from src.category_discovery import CategoryDiscoverer
@@ -12,7 +14,7 @@ from src.product_matcher import ProductMatcher
 from src.recommendation_engine import AdvancedRecommendationEngine
 from utils.metrics import RecommendationMetrics
 from config.paths import PATHS
-import json
+import orjson
 
 class PSBRecommendationSystem:
     def __init__(self):
@@ -23,40 +25,39 @@ class PSBRecommendationSystem:
         self.recommendation_engine = None
         self.metrics_calculator = RecommendationMetrics()
         
+        # Пути результатов базового пайплайна
+        self.output_paths = {
+            name: PATHS.PROCESSED_DIR / filename
+            for name, filename in (('user_profiles', "user_profiles.parquet"),
+                                   ('recommendations', "product_recommendations.parquet"),
+                                   ('metrics', "system_metrics.json"),
+                                   ('categories', "discovered_categories.json"))
+        }
+        
     def run_full_pipeline(self, sample_fraction: float = 0.01, 
                          run_complete_analysis: bool = True):
         """Запуск полного пайплайна рекомендательной системы"""
         print("🚀 Запуск PSB Recommendation System")
         print("=" * 50)
         
+        # Размер чанка для streaming-collect в полном анализе
+        pl.Config.set_streaming_chunk_size(100_000)
+        
         # Этап 1: Загрузка и анализ данных
         print("\n1. 📊 ЗАГРУЗКА ДАННЫХ")
-        data = self.data_processor.load_all_data(sample_fraction)
-        self.data_processor.explore_data_structure(data)
+        data = self.data_processor.load_all_data(sample_fraction, synth_prices=True)
         
         if not data or 'retail_items' not in data:
+            self.data_processor.explore_data_structure(data)
             print("❌ Недостаточно данных для продолжения")
             return
         
-        if 'retail_items' in data:
-            print("\n🔧 Преобразование цен в нормальный масштаб...")
-            items_df = data['retail_items']
-    
-        # Создаем реалистичные цены на основе категорий
-        data['retail_items'] = items_df.with_columns([
-            pl.col('price').alias('price_original'),
-            # Создаем реалистичные цены на основе хэша категории
-            pl.when(pl.col('category').is_not_null())
-            .then((pl.col('category').hash() % 9000) + 1000)  # Цены от 1000 до 10000
-            .otherwise(2000)  # Базовая цена для товаров без категории
-            .alias('price_fixed')
-            ])
-    
-        new_prices = data['retail_items']['price_fixed']
-        print(f"   Исправленные цены: мин={new_prices.min():.2f}, макс={new_prices.max():.2f}, среднее={new_prices.mean():.2f}")
-            # Продолжаем обычный пайплайн
-        print("\n2. 🎯 ОБНАРУЖЕНИЕ КАТЕГОРИЙ")
-        discovered_categories = self.category_discoverer.discover_categories_from_data(data['retail_items'])
+        # Исследование структуры идет в фоне: Polars отпускает GIL, и оно
+        # выполняется параллельно со статистикой цен и обнаружением категорий
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # В полном анализе обзор структуры только по PSB_VERBOSE
+            explore = not run_complete_analysis or bool(os.getenv('PSB_VERBOSE'))
+            discovered_categories = self._prepare_items(data, pool, explore)
         
         print("📋 Обнаруженные категории:")
         if 'existing_categories' in discovered_categories:
@@ -69,10 +70,11 @@ class PSBRecommendationSystem:
         
         if run_complete_analysis:
             # Запуск полного анализа
+            # Ленивые фреймы: join событий с товарами собирается в streaming-режиме
             results = self.recommendation_engine.run_complete_analysis(
-                data['users'],
-                data['retail_events'], 
-                data['retail_items'],
+                data['users'].lazy(),
+                data['retail_events'].lazy(), 
+                data['retail_items'].lazy(),
                 output_dir="results"
             )
             
@@ -84,6 +86,27 @@ class PSBRecommendationSystem:
         
         print("✅ Пайплайн завершен!")
     
+    def _prepare_items(self, data: dict, pool: ThreadPoolExecutor, explore: bool = True) -> dict:
+        """Статистика цен и обнаружение категорий параллельно с explore_data_structure"""
+        explore_future = pool.submit(self.data_processor.explore_data_structure, data) if explore else None
+        
+        # Синтетические цены (price_fixed) уже добавлены при загрузке
+        items_df = data['retail_items']
+        min_price, max_price, mean_price = items_df.select([
+            pl.col('price_fixed').min().alias('min_price'),
+            pl.col('price_fixed').max().alias('max_price'),
+            pl.col('price_fixed').mean().alias('mean_price')
+        ]).row(0)
+        print(f"   Исправленные цены: мин={min_price:.2f}, макс={max_price:.2f}, среднее={mean_price:.2f}")
+        
+        # Продолжаем обычный пайплайн
+        print("\n2. 🎯 ОБНАРУЖЕНИЕ КАТЕГОРИЙ")
+        discovered_categories = self.category_discoverer.discover_categories_from_data(items_df)
+        
+        if explore_future is not None:
+            explore_future.result()
+        return discovered_categories
+    
     def _run_basic_pipeline(self, data: dict, discovered_categories: dict):
         """Запуск базового пайплайна"""
         # Создание профилей пользователей
@@ -132,26 +155,31 @@ class PSBRecommendationSystem:
         
         if 'recommendations' in results:
             recs = results['recommendations']
+            # Все показатели за один проход по таблице рекомендаций
+            stats = recs.select([
+                pl.len().alias('total'),
+                pl.col('user_id').n_unique().alias('unique_users'),
+                *([pl.col('final_score').mean().alias('mean_score')] if 'final_score' in recs.columns else [])
+            ]).row(0, named=True)
             print(f"\n📈 Статистика рекомендаций:")
-            print(f"   Всего рекомендаций: {recs.height}")
-            print(f"   Уникальных пользователей: {recs['user_id'].unique().length()}")
-            if 'final_score' in recs.columns:
-                print(f"   Средний score: {recs['final_score'].mean():.3f}")
+            print(f"   Всего рекомендаций: {stats['total']}")
+            print(f"   Уникальных пользователей: {stats['unique_users']}")
+            if 'mean_score' in stats:
+                print(f"   Средний score: {stats['mean_score']:.3f}")
     
     def _save_basic_results(self, user_profiles, recommendations, metrics, discovered_categories):
         """Сохранение результатов базового пайплайна"""
         PATHS.ensure_directories()
         
-        # Сохраняем данные
-        user_profiles.write_parquet(PATHS.PROCESSED_DIR / "user_profiles.parquet")
-        recommendations.write_parquet(PATHS.PROCESSED_DIR / "product_recommendations.parquet")
-        
-        # Сохраняем метрики и категории
-        with open(PATHS.PROCESSED_DIR / "system_metrics.json", 'w', encoding='utf-8') as f:
-            json.dump(metrics, f, ensure_ascii=False, indent=2)
+        # Сохраняем данные потоково, по row group за раз
+        parquet_options = dict(compression="zstd", compression_level=3, row_group_size=100_000, statistics=True)
+        user_profiles.lazy().sink_parquet(self.output_paths['user_profiles'], **parquet_options)
+        recommendations.lazy().sink_parquet(self.output_paths['recommendations'], **parquet_options)
         
-        with open(PATHS.PROCESSED_DIR / "discovered_categories.json", 'w', encoding='utf-8') as f:
-            json.dump(discovered_categories, f, ensure_ascii=False, indent=2)
+        # Сохраняем метрики и категории: один orjson.dumps и одна запись на файл
+        json_options = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        for name, payload in (('metrics', metrics), ('categories', discovered_categories)):
+            self.output_paths[name].write_bytes(orjson.dumps(payload, option=json_options))
         
         print(f"💾 Результаты сохранены в {PATHS.PROCESSED_DIR}")
 
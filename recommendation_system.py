@@ -6,10 +6,13 @@
 import polars as pl
 import numpy as np
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import ClassVar, Dict, List, NamedTuple, Optional, Tuple
 import json
 from datetime import datetime
 from dataclasses import dataclass
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 
 @dataclass
@@ -26,6 +29,33 @@ class UserProfile:
     estimated_income_bracket: str
     active_categories: List[str]
     total_transactions: int
+    active_category_mask: Optional[int] = None  # биты BankProductMatcher.category_bits
+
+
+class RuleArrays(NamedTuple):
+    """PRODUCT_RULES, скомпилированные в массивы по продуктам (P) для векторного скоринга.
+    
+    Отсутствующее правило не требует ветвлений: обратный порог 0, уровень -1,
+    порог волатильности NaN, пустая строка маски.
+    """
+    inv_lifetime_value: np.ndarray  # [P] 1 / min_lifetime_value
+    min_spending_level: np.ndarray  # [P] int8, код уровня трат
+    required_income: np.ndarray  # [K + 1, P] bool по коду дохода
+    inv_avg_transaction: np.ndarray  # [P] 1 / min_avg_transaction
+    required_frequency: np.ndarray  # [K + 1, P] bool по коду частоты
+    suitable_categories: np.ndarray  # [C, P] 0/1 по категориям правил
+    max_volatility: np.ndarray  # [P]
+    inv_transactions: np.ndarray  # [P] 1 / min_transactions
+    scale: np.ndarray  # [P] weight / max_score
+
+
+# Колонки фрейма профилей: поля UserProfile, аффинити — двумя параллельными списками
+PROFILE_COLUMNS = [
+    'user_id', 'spending_level', 'purchase_frequency', 'price_sensitivity',
+    'avg_transaction_value', 'lifetime_value', 'purchase_volatility',
+    'estimated_income_bracket', 'total_transactions',
+    'affinity_categories', 'affinity_scores', 'active_category_mask',
+]
 
 
 class DataProcessor:
@@ -36,53 +66,61 @@ class DataProcessor:
         
     def load_users(self) -> pl.DataFrame:
         """Загрузка данных пользователей"""
-        return pl.read_parquet(self.data_path / "users.pq")
+        return self._strings_to_categorical(pl.read_parquet(self.data_path / "users.pq"), ['user_id'])
     
     def load_retail_items(self) -> pl.DataFrame:
-        """Загрузка товаров retail"""
-        return pl.read_parquet(self.data_path / "retail" / "items.pq")
+        """Загрузка товаров retail (цена в Float32: вдвое меньше байт на каждую покупку)"""
+        items = pl.read_parquet(self.data_path / "retail" / "items.pq")
+        if 'price' in items.columns:
+            items = items.with_columns(pl.col('price').cast(pl.Float32))
+        return self._strings_to_categorical(items, ['category'])
     
-    def load_retail_events(self, limit_files: int = 10) -> pl.DataFrame:
+    def load_retail_events(self, limit_files: int = 10) -> pl.LazyFrame:
         """Загрузка событий retail (с ограничением для быстрой обработки)"""
-        events_path = self.data_path / "retail" / "events"
-        event_files = sorted(list(events_path.glob("*.pq")))[:limit_files]
-        
-        dfs = []
-        for file in event_files:
-            df = pl.read_parquet(file)
-            dfs.append(df)
-        
-        return pl.concat(dfs)
+        return self._scan_events("retail", limit_files)
     
-    def load_marketplace_events(self, limit_files: int = 10) -> pl.DataFrame:
+    def load_marketplace_events(self, limit_files: int = 10) -> pl.LazyFrame:
         """Загрузка событий marketplace"""
-        events_path = self.data_path / "marketplace" / "events"
-        event_files = sorted(list(events_path.glob("*.pq")))[:limit_files]
-        
-        dfs = []
-        for file in event_files:
-            df = pl.read_parquet(file)
-            dfs.append(df)
-        
-        return pl.concat(dfs)
+        return self._scan_events("marketplace", limit_files)
     
-    def load_offers_events(self, limit_files: int = 10) -> pl.DataFrame:
+    def load_offers_events(self, limit_files: int = 10) -> pl.LazyFrame:
         """Загрузка событий offers"""
-        events_path = self.data_path / "offers" / "events"
-        event_files = sorted(list(events_path.glob("*.pq")))[:limit_files]
-        
-        dfs = []
-        for file in event_files:
-            df = pl.read_parquet(file)
-            dfs.append(df)
-        
-        return pl.concat(dfs)
+        return self._scan_events("offers", limit_files)
+    
+    def _scan_events(self, domain: str, limit_files: int) -> pl.LazyFrame:
+        """Ленивое сканирование первых limit_files файлов событий домена.
+        
+        Фильтры и select() последующих шагов проталкиваются в чтение parquet;
+        файлы читаются одним сканом без склейки, с экономией памяти.
+        Если каталог разбит на hive-партиции (key=value/*.pq), ключи партиций
+        становятся колонками и фильтры по ним отсекают целые каталоги.
+        """
+        events_path = self.data_path / domain / "events"
+        partitioned = any(d.is_dir() for d in events_path.glob("*=*"))
+        event_files = sorted(events_path.glob("**/*.pq" if partitioned else "*.pq"))[:limit_files]
+        
+        events = pl.scan_parquet(
+            [str(f) for f in event_files], parallel="prefiltered", low_memory=True,
+            hive_partitioning=partitioned
+        )
+        return self._strings_to_categorical(events, ['user_id'])
+    
+    @staticmethod
+    def _strings_to_categorical(df, columns: List[str]):
+        """Строковые ключи join/group_by -> pl.Categorical (u32-коды вместо байт строк).
+        
+        Коды согласованы между фреймами только внутри pl.StringCache().
+        """
+        schema = df.collect_schema() if isinstance(df, pl.LazyFrame) else df.schema
+        return df.with_columns([
+            pl.col(c).cast(pl.Categorical) for c in columns if schema.get(c) == pl.String
+        ])
 
 
 class CategoryMapper:
     """Маппинг категорий товаров в бизнес-категории"""
     
-    CATEGORY_MAPPING = {
+    CATEGORY_MAPPING: ClassVar[dict[str, str]] = {
         # Electronics & Tech
         'Электроника': 'electronics',
         'Компьютеры': 'electronics',
@@ -114,13 +152,34 @@ class CategoryMapper:
         'Другое': 'other'
     }
     
-    PRICE_SEGMENTS = {
+    # Фиксированный домен бизнес-категорий (для pl.Enum)
+    BUSINESS_CATEGORIES = sorted(set(CATEGORY_MAPPING.values()) | {'other'})
+    
+    PRICE_SEGMENTS: ClassVar[dict[str, tuple[float, float]]] = {
         'budget': (0, 5000),
         'medium': (5000, 20000),
         'premium': (20000, 100000),
         'luxury': (100000, float('inf'))
     }
     
+    @classmethod
+    def annotate(cls, items_lf: pl.LazyFrame) -> pl.LazyFrame:
+        """Векторная версия categorize_item для всего каталога товаров"""
+        price = pl.col('price')
+        
+        return items_lf.with_columns([
+            pl.col('category').cast(pl.String)
+            .replace_strict(cls.CATEGORY_MAPPING, default='other', return_dtype=pl.Enum(cls.BUSINESS_CATEGORIES))
+            .alias('business_category'),
+            price.cut([5000, 20000, 100000], labels=list(cls.PRICE_SEGMENTS), left_closed=True)
+            .alias('price_segment'),
+            price.cut([5000, 50000], labels=['low_value', 'medium_value', 'high_value_durable'], left_closed=True)
+            .alias('purchase_type'),
+            price.cut([10000, 50000], labels=['low_investment', 'medium_investment', 'high_investment'],
+                      left_closed=True)
+            .alias('financial_implication'),
+        ])
+    
     @classmethod
     def categorize_item(cls, category: str, price: float) -> Dict:
         """Категоризация товара"""
@@ -151,116 +210,128 @@ class CategoryMapper:
 class UserProfileEngine:
     """Создание профилей пользователей"""
     
+    # Gather по item_id вместо join, если max(item_id) < DENSE_ITEM_ID_RATIO * число товаров
+    DENSE_ITEM_ID_RATIO = 10
+    
+    # Границы классов по возрастанию и метки интервалов между ними
+    SPENDING_THRESHOLDS = np.array([50000, 200000])  # [a, b)
+    SPENDING_LABELS: ClassVar[list[str]] = ['low', 'medium', 'high']
+    FREQUENCY_THRESHOLDS = np.array([0.15, 0.5])  # (a, b]
+    FREQUENCY_LABELS: ClassVar[list[str]] = ['monthly', 'weekly', 'daily']
+    INCOME_THRESHOLDS = np.array([3000, 8000, 15000, 25000])  # [a, b)
+    INCOME_LABELS: ClassVar[list[str]] = ['low', 'medium_low', 'medium', 'medium_high', 'high']
+    
     def __init__(self):
         self.category_mapper = CategoryMapper()
     
+    def build_metrics(
+        self,
+        events_df: pl.LazyFrame,
+        items_df: pl.DataFrame
+    ) -> Tuple[pl.LazyFrame, pl.LazyFrame]:
+        """Метрики пользователей и аффинити к категориям из одного плана покупок.
+        
+        Join событий с товарами общий (cache()), поэтому при pl.collect_all
+        он выполняется один раз для обеих веток.
+        """
+        purchases = self._join_purchases(events_df, items_df).cache()
+        return self._aggregate_user_metrics(purchases), self._aggregate_category_affinity(purchases)
+    
     def calculate_user_metrics(
         self, 
-        events_df: pl.DataFrame, 
+        events_df: pl.LazyFrame, 
         items_df: pl.DataFrame
-    ) -> pl.DataFrame:
+    ) -> pl.LazyFrame:
         """Расчет метрик пользователей"""
         
-        # Присоединяем информацию о товарах
-        events_with_items = events_df.join(
-            items_df.select(['item_id', 'category', 'price']),
-            on='item_id',
-            how='left'
-        )
-        
-        # Фильтруем только покупки
-        purchases = events_with_items.filter(
-            pl.col('action_type') == 'purchase'
-        )
+        # Фильтруем только покупки и присоединяем информацию о товарах
+        return self._aggregate_user_metrics(self._join_purchases(events_df, items_df))
+    
+    def _aggregate_user_metrics(self, purchases: pl.LazyFrame) -> pl.LazyFrame:
+        """Агрегация метрик пользователей по покупкам"""
+        # Все метрики, включая производные, считаются в одном group_by без доп. проходов;
+        # цена хранится в Float32, агрегаты накапливаются в Float64
+        price = pl.col('price').cast(pl.Float64)
+        total_transactions = pl.len()
+        avg_transaction_value = price.mean()
+        days_active = (pl.col('timestamp').max() - pl.col('timestamp').min()) / (24 * 3600 * 1000)
         
-        # Базовые метрики по пользователям
         user_metrics = purchases.group_by('user_id').agg([
-            pl.count().alias('total_transactions'),
-            pl.col('price').sum().alias('lifetime_value'),
-            pl.col('price').mean().alias('avg_transaction_value'),
-            pl.col('price').std().alias('price_std'),
+            total_transactions.alias('total_transactions'),
+            price.sum().alias('lifetime_value'),
+            avg_transaction_value.alias('avg_transaction_value'),
+            price.std().alias('price_std'),
             pl.col('timestamp').min().alias('first_purchase'),
             pl.col('timestamp').max().alias('last_purchase'),
-        ])
-        
-        # Расчет частоты покупок
-        user_metrics = user_metrics.with_columns([
-            ((pl.col('last_purchase') - pl.col('first_purchase')) / 
-             (24 * 3600 * 1000)).alias('days_active')
-        ])
-        
-        user_metrics = user_metrics.with_columns([
-            (pl.col('total_transactions') / 
-             (pl.col('days_active') + 1)).alias('purchase_frequency_per_day')
-        ])
-        
-        # Волатильность покупок
-        user_metrics = user_metrics.with_columns([
-            (pl.col('price_std') / 
-             (pl.col('avg_transaction_value') + 1)).alias('purchase_volatility')
+            days_active.alias('days_active'),
+            # Частота покупок
+            (total_transactions / (days_active + 1)).alias('purchase_frequency_per_day'),
+            # Волатильность покупок
+            (price.std() / (avg_transaction_value + 1)).alias('purchase_volatility'),
         ])
         
         return user_metrics
     
     def calculate_category_affinity(
         self,
-        events_df: pl.DataFrame,
+        events_df: pl.LazyFrame,
         items_df: pl.DataFrame
-    ) -> pl.DataFrame:
+    ) -> pl.LazyFrame:
         """Расчет аффинити к категориям"""
         
-        events_with_items = events_df.join(
-            items_df.select(['item_id', 'category', 'price']),
-            on='item_id',
-            how='left'
-        )
-        
-        purchases = events_with_items.filter(
-            pl.col('action_type') == 'purchase'
-        )
-        
-        # Подсчет трат по категориям
-        category_spending = purchases.group_by(['user_id', 'category']).agg([
-            pl.col('price').sum().alias('category_spending'),
-            pl.count().alias('category_purchases')
-        ])
-        
-        # Общие траты пользователя
-        total_spending = purchases.group_by('user_id').agg([
-            pl.col('price').sum().alias('total_spending')
-        ])
-        
-        # Расчет доли категории
-        category_affinity = category_spending.join(
-            total_spending,
-            on='user_id',
-            how='left'
-        )
-        
-        category_affinity = category_affinity.with_columns([
-            (pl.col('category_spending') / 
-             pl.col('total_spending')).alias('affinity_score')
+        return self._aggregate_category_affinity(self._join_purchases(events_df, items_df))
+    
+    def _aggregate_category_affinity(self, purchases: pl.LazyFrame) -> pl.LazyFrame:
+        """Доля трат пользователя по категориям"""
+        # Траты по категориям; доля — к сумме трат пользователя окном по user_id (без join)
+        category_affinity = purchases.group_by(['user_id', 'category']).agg([
+            pl.col('price').cast(pl.Float64).sum().alias('category_spending'),
+            pl.len().alias('category_purchases')
+        ]).with_columns([
+            (pl.col('category_spending') /
+             pl.col('category_spending').sum().over('user_id')).alias('affinity_score')
         ])
         
         return category_affinity
     
+    def _join_purchases(self, events_df: pl.LazyFrame, items_df: pl.DataFrame) -> pl.LazyFrame:
+        """Покупки с категорией и ценой товара (фильтр и проекция до join)"""
+        purchases = (
+            events_df.lazy()
+            .filter(pl.col('action_type') == 'purchase')
+            .select(['user_id', 'item_id', 'timestamp'])
+        )
+        items = items_df.select(['item_id', 'category', 'price'])
+        
+        # Плотные целочисленные item_id: вместо hash join — gather из массивов по индексу товара
+        item_ids = items.get_column('item_id')
+        if (
+            item_ids.dtype.is_integer() and not items.is_empty()
+            and item_ids.min() >= 0 and item_ids.n_unique() == items.height
+            and item_ids.max() < self.DENSE_ITEM_ID_RATIO * items.height
+        ):
+            max_id = item_ids.max()
+            dense = (
+                pl.DataFrame({'item_id': pl.int_range(0, max_id + 1, dtype=item_ids.dtype, eager=True)})
+                .join(items, on='item_id', how='left')
+                .sort('item_id')
+            )
+            known = pl.col('item_id').is_between(0, max_id)
+            index = pl.col('item_id').clip(0, max_id)
+            return purchases.with_columns([
+                pl.when(known).then(pl.lit(dense.get_column(column)).gather(index)).alias(column)
+                for column in ['category', 'price']
+            ])
+        
+        return purchases.join(items.lazy(), on='item_id', how='left')
+    
     def classify_spending_level(self, lifetime_value: float) -> str:
         """Классификация уровня трат"""
-        if lifetime_value < 50000:
-            return 'low'
-        elif lifetime_value < 200000:
-            return 'medium'
-        else:
-            return 'high'
+        return self.SPENDING_LABELS[np.searchsorted(self.SPENDING_THRESHOLDS, lifetime_value, side='right')]
     
     def classify_purchase_frequency(self, freq_per_day: float) -> str:
         """Классификация частоты покупок"""
-        if freq_per_day > 0.5:
-            return 'daily'
-        elif freq_per_day > 0.15:
-            return 'weekly'
-        else:
-            return 'monthly'
+        return self.FREQUENCY_LABELS[np.searchsorted(self.FREQUENCY_THRESHOLDS, freq_per_day, side='left')]
     
     def estimate_income_bracket(
         self, 
@@ -269,17 +340,7 @@ class UserProfileEngine:
     ) -> str:
         """Оценка уровня дохода"""
         score = avg_transaction * 0.4 + lifetime_value * 0.0001
-        
-        if score < 3000:
-            return 'low'
-        elif score < 8000:
-            return 'medium_low'
-        elif score < 15000:
-            return 'medium'
-        elif score < 25000:
-            return 'medium_high'
-        else:
-            return 'high'
+        return self.INCOME_LABELS[np.searchsorted(self.INCOME_THRESHOLDS, score, side='right')]
     
     def calculate_price_sensitivity(
         self,
@@ -293,6 +354,30 @@ class UserProfileEngine:
         # Высокая волатильность = низкая чувствительность к цене
         return max(0, min(1, 1 - volatility))
     
+    def classification_exprs(self) -> List[pl.Expr]:
+        """Векторные версии classify_*/estimate_*/calculate_price_sensitivity"""
+        ltv = pl.col('lifetime_value').fill_null(0)
+        avg_txn = pl.col('avg_transaction_value').fill_null(0)
+        freq = pl.col('purchase_frequency_per_day').fill_null(0)
+        income_score = avg_txn * 0.4 + ltv * 0.0001
+        volatility = (pl.col('price_std') / avg_txn).fill_null(0).fill_nan(0)
+        
+        return [
+            ltv.cut(self.SPENDING_THRESHOLDS.tolist(), labels=self.SPENDING_LABELS, left_closed=True)
+            .alias('spending_level'),
+            
+            freq.cut(self.FREQUENCY_THRESHOLDS.tolist(), labels=self.FREQUENCY_LABELS)
+            .alias('purchase_frequency'),
+            
+            income_score.cut(self.INCOME_THRESHOLDS.tolist(), labels=self.INCOME_LABELS, left_closed=True)
+            .alias('estimated_income_bracket'),
+            
+            # Высокая волатильность = низкая чувствительность к цене
+            pl.when(avg_txn == 0).then(pl.lit(0.5))
+            .otherwise((1 - volatility).clip(0, 1))
+            .alias('price_sensitivity'),
+        ]
+    
     def create_user_profile(
         self,
         user_id: str,
@@ -308,20 +393,31 @@ class UserProfileEngine:
         volatility = metrics_row.get('purchase_volatility', 0)
         total_txn = metrics_row.get('total_transactions', 0)
         
+        # Классы, уже посчитанные classification_exprs(), берем из строки
+        if 'spending_level' in metrics_row:
+            spending_level = metrics_row['spending_level']
+            purchase_frequency = metrics_row['purchase_frequency']
+            income_bracket = metrics_row['estimated_income_bracket']
+            price_sensitivity = metrics_row['price_sensitivity']
+        else:
+            spending_level = self.classify_spending_level(lifetime_value)
+            purchase_frequency = self.classify_purchase_frequency(freq_per_day)
+            income_bracket = self.estimate_income_bracket(avg_transaction, lifetime_value)
+            price_sensitivity = self.calculate_price_sensitivity(price_std, avg_transaction)
+        
         return UserProfile(
             user_id=user_id,
-            spending_level=self.classify_spending_level(lifetime_value),
-            purchase_frequency=self.classify_purchase_frequency(freq_per_day),
+            spending_level=spending_level,
+            purchase_frequency=purchase_frequency,
             category_affinity=category_affinity,
-            price_sensitivity=self.calculate_price_sensitivity(price_std, avg_transaction),
+            price_sensitivity=price_sensitivity,
             avg_transaction_value=avg_transaction,
             lifetime_value=lifetime_value,
             purchase_volatility=volatility,
-            estimated_income_bracket=self.estimate_income_bracket(
-                avg_transaction, lifetime_value
-            ),
+            estimated_income_bracket=income_bracket,
             active_categories=list(category_affinity.keys()),
-            total_transactions=total_txn
+            total_transactions=total_txn,
+            active_category_mask=metrics_row.get('active_category_mask')
         )
 
 
@@ -329,7 +425,7 @@ class BankProductMatcher:
     """Сопоставление пользователей с банковскими продуктами"""
     
     # Правила для банковских продуктов
-    PRODUCT_RULES = {
+    PRODUCT_RULES: ClassVar[dict[str, dict]] = {
         # Премиум продукты
         'ПСБ.Premium': {
             'min_lifetime_value': 300000,
@@ -402,6 +498,231 @@ class BankProductMatcher:
         },
     }
     
+    # Максимальный вклад каждого правила в скор продукта
+    RULE_POINTS: ClassVar[dict[str, float]] = {
+        'min_lifetime_value': 2.0,
+        'min_spending_level': 1.5,
+        'required_income': 1.5,
+        'min_avg_transaction': 1.0,
+        'required_frequency': 1.0,
+        'suitable_categories': 2.0,
+        'max_volatility': 1.0,
+        'min_transactions': 1.0,
+    }
+    
+    # Порядковые коды строковых признаков профиля
+    SPENDING_LEVELS: ClassVar[dict[str, int]] = {'low': 0, 'medium': 1, 'high': 2}
+    INCOME_BRACKETS: ClassVar[list[str]] = ['low', 'medium_low', 'medium', 'medium_high', 'high']
+    PURCHASE_FREQUENCIES: ClassVar[list[str]] = ['daily', 'weekly', 'monthly']
+    
+    def __init__(self):
+        self.product_names = list(self.PRODUCT_RULES)
+        
+        # Нормировочный максимум скора зависит только от набора правил продукта
+        self._max_score = {
+            name: self._rule_max_score(rules) for name, rules in self.PRODUCT_RULES.items()
+        }
+        
+        # Категории, встречающиеся в правилах (колонки матрицы аффинити)
+        self.rule_categories = sorted({
+            cat for rules in self.PRODUCT_RULES.values() for cat in rules.get('suitable_categories', [])
+        })
+        self._rule_arrays = self._compile_rules()
+        
+        # Битовые маски подходящих категорий продуктов для бонуса активности
+        self.category_bits = {cat: 1 << i for i, cat in enumerate(self.rule_categories)}
+        self._product_category_masks = [
+            self._category_mask(rules.get('suitable_categories', [])) for rules in self.PRODUCT_RULES.values()
+        ]
+    
+    @classmethod
+    def _rule_max_score(cls, rules: Dict) -> float:
+        """Сумма максимальных вкладов правил, заданных для продукта"""
+        return sum(points for key, points in cls.RULE_POINTS.items() if key in rules)
+    
+    def _category_mask(self, categories) -> int:
+        """Битовая маска категорий из словаря rule_categories"""
+        mask = 0
+        for cat in categories:
+            mask |= self.category_bits.get(cat, 0)
+        return mask
+    
+    def _active_mask(self, user_profile: UserProfile) -> int:
+        """Маска активных категорий профиля (предпосчитанная или из active_categories)"""
+        if user_profile.active_category_mask is not None:
+            return user_profile.active_category_mask
+        return self._category_mask(user_profile.active_categories)
+    
+    def _compile_rules(self) -> RuleArrays:
+        """Компиляция PRODUCT_RULES в непрерывные массивы по продуктам (один раз при создании)"""
+        rules = [self.PRODUCT_RULES[name] for name in self.product_names]
+        
+        def thresholds(key):
+            return np.array([r.get(key, np.nan) for r in rules], dtype=np.float64)
+        
+        def inverse(values):
+            # 1 / порог; 0 для отсутствующего правила (вклад обнуляется без ветвлений)
+            return np.divide(1.0, values, out=np.zeros_like(values), where=~np.isnan(values))
+        
+        def membership(key, values):
+            return np.array([[v in r.get(key, []) for v in values] for r in rules], dtype=bool)
+        
+        min_lifetime_value = thresholds('min_lifetime_value')
+        min_avg_transaction = thresholds('min_avg_transaction')
+        min_transactions = thresholds('min_transactions')
+        max_volatility = thresholds('max_volatility')
+        min_spending_level = np.array([
+            self.SPENDING_LEVELS.get(r['min_spending_level'], 0) if 'min_spending_level' in r else -1
+            for r in rules
+        ], dtype=np.int8)
+        weight = np.array([r.get('weight', 1.0) for r in rules], dtype=np.float64)
+        
+        max_score = np.array([self._max_score[name] for name in self.product_names], dtype=np.float64)
+        
+        return RuleArrays(
+            inv_lifetime_value=inverse(min_lifetime_value),
+            min_spending_level=min_spending_level,
+            # Маски [K, P]: строка по коду признака пользователя, последняя строка — неизвестный код
+            required_income=np.vstack([
+                membership('required_income', self.INCOME_BRACKETS).T, np.zeros(len(rules), dtype=bool)
+            ]),
+            inv_avg_transaction=inverse(min_avg_transaction),
+            required_frequency=np.vstack([
+                membership('required_frequency', self.PURCHASE_FREQUENCIES).T, np.zeros(len(rules), dtype=bool)
+            ]),
+            suitable_categories=np.ascontiguousarray(
+                membership('suitable_categories', self.rule_categories).T, dtype=np.float64
+            ),
+            max_volatility=max_volatility,
+            inv_transactions=inverse(min_transactions),
+            # Нормализация и вес в одном множителе; 0 для продукта без правил
+            scale=np.divide(weight, max_score, out=np.zeros_like(weight), where=max_score > 0),
+        )
+    
+    def score_matrix(self, user_profiles: List[UserProfile], out: np.ndarray | None = None) -> np.ndarray:
+        """Скоры всех пользователей по всем продуктам (U x P) одним векторным проходом.
+        
+        Совпадает с calculate_product_score + бонусом категорий из recommend_products.
+        Вклады правил накапливаются на месте в out (выделяется, если не передан).
+        """
+        def column(attr):
+            values = [getattr(p, attr) for p in user_profiles]
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        
+        def codes(attr, values):
+            # Неизвестное значение -> последняя (пустая) строка маски
+            index = {v: i for i, v in enumerate(values)}
+            return np.array([index.get(getattr(p, attr), len(values)) for p in user_profiles])
+        
+        n_users, n_categories = len(user_profiles), len(self.rule_categories)
+        features = {
+            attr: column(attr)
+            for attr in ['lifetime_value', 'avg_transaction_value', 'total_transactions', 'purchase_volatility']
+        }
+        features['spending_level'] = np.array([self.SPENDING_LEVELS.get(p.spending_level, 0) for p in user_profiles])
+        features['estimated_income_bracket'] = codes('estimated_income_bracket', self.INCOME_BRACKETS)
+        features['purchase_frequency'] = codes('purchase_frequency', self.PURCHASE_FREQUENCIES)
+        features['affinity'] = np.array([
+            [p.category_affinity.get(cat, 0) or 0 for cat in self.rule_categories] for p in user_profiles
+        ], dtype=np.float64).reshape(n_users, n_categories)
+        features['active_category_mask'] = np.array([self._active_mask(p) for p in user_profiles], dtype=np.uint64)
+        return self._score_features(features, n_users, out)
+    
+    def score_frame(self, profiles: pl.DataFrame, out: np.ndarray | None = None) -> np.ndarray:
+        """score_matrix для колоночного фрейма профилей (PROFILE_COLUMNS), без объектов UserProfile"""
+        n_users, n_categories = profiles.height, len(self.rule_categories)
+        
+        def codes(column, values):
+            # Неизвестное значение -> последняя (пустая) строка маски
+            return (
+                profiles.get_column(column).cast(pl.String)
+                .replace_strict(values, list(range(len(values))), default=len(values), return_dtype=pl.Int64)
+                .to_numpy()
+            )
+        
+        features = {
+            attr: profiles.get_column(attr).cast(pl.Float64).fill_null(np.nan).to_numpy()
+            for attr in ['lifetime_value', 'avg_transaction_value', 'total_transactions', 'purchase_volatility']
+        }
+        features['spending_level'] = (
+            profiles.get_column('spending_level').cast(pl.String)
+            .replace_strict(self.SPENDING_LEVELS, default=0, return_dtype=pl.Int64).to_numpy()
+        )
+        features['estimated_income_bracket'] = codes('estimated_income_bracket', self.INCOME_BRACKETS)
+        features['purchase_frequency'] = codes('purchase_frequency', self.PURCHASE_FREQUENCIES)
+        features['active_category_mask'] = (
+            profiles.get_column('active_category_mask').cast(pl.UInt64).fill_null(0).to_numpy()
+        )
+        
+        # Аффинити по категориям правил: разворачиваем списки и раскладываем по (строка, категория)
+        affinity_cells = (
+            profiles.select([
+                pl.int_range(pl.len()).alias('row'),
+                pl.col('affinity_categories').cast(pl.List(pl.String)),
+                'affinity_scores'
+            ])
+            .explode(['affinity_categories', 'affinity_scores'])
+            .filter(pl.col('affinity_categories').is_in(self.rule_categories))
+            .with_columns(
+                pl.col('affinity_categories')
+                .replace_strict(self.rule_categories, list(range(n_categories)), return_dtype=pl.Int64)
+            )
+        )
+        features['affinity'] = np.zeros((n_users, n_categories), dtype=np.float64)
+        np.add.at(
+            features['affinity'],
+            (affinity_cells['row'].to_numpy(), affinity_cells['affinity_categories'].to_numpy()),
+            affinity_cells['affinity_scores'].fill_null(0).to_numpy()
+        )
+        return self._score_features(features, n_users, out)
+    
+    def _score_features(self, features: Dict[str, np.ndarray], n_users: int, out: np.ndarray | None = None) -> np.ndarray:
+        """Векторный скоринг по столбцам признаков пользователей (ядро score_matrix/score_frame)"""
+        rules = self._rule_arrays
+        if out is None:
+            out = np.empty((n_users, len(self.product_names)), dtype=np.float64)
+        buffer = np.empty_like(out)
+        
+        def add_ratio(value, inverse, points):
+            # points * min(1, value / threshold); для отсутствующего правила inverse = 0
+            np.multiply(value, inverse, out=buffer)
+            np.minimum(buffer, 1.0, out=buffer)
+            np.multiply(buffer, points, out=buffer)
+            np.add(out, buffer, out=out)
+        
+        # Наличие активности по категориям правил (U x C) из битовых масок
+        bits = np.arange(len(self.rule_categories), dtype=np.uint64)
+        active = ((features['active_category_mask'][:, None] >> bits) & 1).astype(np.float64)
+        
+        # Категории: 2.0 * min(1, сумма аффинити по подходящим категориям)
+        affinity = features['affinity']
+        missing_affinity = np.isnan(affinity)  # 0/0 у пользователя без трат
+        np.matmul(np.where(missing_affinity, 0.0, affinity), rules.suitable_categories, out=out)
+        np.minimum(out, 1.0, out=out)
+        if missing_affinity.any():
+            # Как min(1.0, nan) == 1.0 в calculate_product_score: NaN среди подходящих категорий -> 1
+            out[(missing_affinity @ rules.suitable_categories) > 0] = 1.0
+        out *= 2.0
+        
+        spending = features['spending_level'][:, None]
+        out += 1.5 * ((rules.min_spending_level >= 0) & (spending >= rules.min_spending_level))
+        out += 1.5 * rules.required_income[features['estimated_income_bracket']]
+        out += 1.0 * rules.required_frequency[features['purchase_frequency']]
+        out += 1.0 * (features['purchase_volatility'][:, None] <= rules.max_volatility)
+        
+        add_ratio(np.nan_to_num(features['lifetime_value'])[:, None], rules.inv_lifetime_value, 2.0)
+        add_ratio(np.nan_to_num(features['avg_transaction_value'])[:, None], rules.inv_avg_transaction, 1.0)
+        add_ratio(np.nan_to_num(features['total_transactions'])[:, None], rules.inv_transactions, 1.0)
+        
+        # Нормализация и применение веса
+        out *= rules.scale
+        
+        # Бонус за соответствие категориям активности
+        np.matmul(active, rules.suitable_categories, out=buffer)
+        buffer *= 0.1
+        out += buffer
+        return out
+    
     def calculate_product_score(
         self,
         user_profile: UserProfile,
@@ -410,11 +731,9 @@ class BankProductMatcher:
     ) -> float:
         """Расчет скора соответствия продукта пользователю"""
         score = 0.0
-        max_score = 0.0
         
         # Проверка LTV
         if 'min_lifetime_value' in rules:
-            max_score += 2.0
             if user_profile.lifetime_value >= rules['min_lifetime_value']:
                 score += 2.0
             else:
@@ -423,7 +742,6 @@ class BankProductMatcher:
         
         # Проверка уровня трат
         if 'min_spending_level' in rules:
-            max_score += 1.5
             levels = {'low': 0, 'medium': 1, 'high': 2}
             if levels.get(user_profile.spending_level, 0) >= \
                levels.get(rules['min_spending_level'], 0):
@@ -431,13 +749,11 @@ class BankProductMatcher:
         
         # Проверка дохода
         if 'required_income' in rules:
-            max_score += 1.5
             if user_profile.estimated_income_bracket in rules['required_income']:
                 score += 1.5
         
         # Проверка среднего чека
         if 'min_avg_transaction' in rules:
-            max_score += 1.0
             if user_profile.avg_transaction_value >= rules['min_avg_transaction']:
                 score += 1.0
             else:
@@ -446,13 +762,11 @@ class BankProductMatcher:
         
         # Проверка частоты покупок
         if 'required_frequency' in rules:
-            max_score += 1.0
             if user_profile.purchase_frequency in rules['required_frequency']:
                 score += 1.0
         
         # Проверка категорий
         if 'suitable_categories' in rules:
-            max_score += 2.0
             category_match = sum(
                 user_profile.category_affinity.get(cat, 0)
                 for cat in rules['suitable_categories']
@@ -461,13 +775,11 @@ class BankProductMatcher:
         
         # Проверка волатильности
         if 'max_volatility' in rules:
-            max_score += 1.0
             if user_profile.purchase_volatility <= rules['max_volatility']:
                 score += 1.0
         
         # Проверка количества транзакций
         if 'min_transactions' in rules:
-            max_score += 1.0
             if user_profile.total_transactions >= rules['min_transactions']:
                 score += 1.0
             else:
@@ -475,6 +787,9 @@ class BankProductMatcher:
                 score += 1.0 * min(1.0, ratio)
         
         # Нормализация и применение веса
+        max_score = self._max_score.get(product_name)
+        if max_score is None:
+            max_score = self._rule_max_score(rules)
         if max_score > 0:
             normalized_score = (score / max_score) * rules.get('weight', 1.0)
             return normalized_score
@@ -488,34 +803,29 @@ class BankProductMatcher:
     ) -> List[Tuple[str, float]]:
         """Рекомендация топ-N продуктов для пользователя"""
         
-        product_scores = []
-        
-        for product_name, rules in self.PRODUCT_RULES.items():
-            score = self.calculate_product_score(
-                user_profile,
+        # Бонус за соответствие категориям активности: пересечение битовых масок
+        active_mask = self._active_mask(user_profile)
+        product_scores = [
+            (
                 product_name,
-                rules
+                self.calculate_product_score(user_profile, product_name, rules)
+                + (active_mask & category_mask).bit_count() * 0.1
             )
-            
-            # Бонус за соответствие категориям активности
-            if user_profile.active_categories:
-                category_bonus = len(
-                    set(user_profile.active_categories) & 
-                    set(rules.get('suitable_categories', []))
-                ) * 0.1
-                score += category_bonus
-            
-            product_scores.append((product_name, score))
-        
-        # Сортировка по скору
-        product_scores.sort(key=lambda x: x[1], reverse=True)
+            for (product_name, rules), category_mask in zip(
+                self.PRODUCT_RULES.items(), self._product_category_masks
+            )
+        ]
         
-        return product_scores[:top_n]
+        # Частичный отбор топ-N по скору (порядок равных как у стабильной сортировки)
+        return heapq.nlargest(top_n, product_scores, key=lambda x: x[1])
 
 
 class RecommendationSystem:
     """Главный класс рекомендательной системы"""
     
+    # Минимум строк профилей на поток при скоринге
+    SCORING_CHUNK_ROWS = 50_000
+    
     def __init__(self, data_path: str = "data/dataset/small"):
         self.data_processor = DataProcessor(data_path)
         self.profile_engine = UserProfileEngine()
@@ -524,70 +834,122 @@ class RecommendationSystem:
     def build_user_profiles(
         self,
         limit_files: int = 5
-    ) -> Dict[str, UserProfile]:
-        """Построение профилей пользователей"""
+    ) -> pl.DataFrame:
+        """Построение профилей пользователей (фрейм PROFILE_COLUMNS, строка на пользователя)"""
+        # Общий кэш строк: категориальные коды согласованы между всеми фреймами
+        with pl.StringCache():
+            return self._build_user_profiles(limit_files)
+    
+    def _build_user_profiles(self, limit_files: int) -> pl.DataFrame:
+        """Построение профилей пользователей (внутри pl.StringCache)"""
         
         print("Загрузка данных...")
         items_df = self.data_processor.load_retail_items()
         events_df = self.data_processor.load_retail_events(limit_files)
         
         print(f"Загружено {len(items_df)} товаров")
-        print(f"Загружено {len(events_df)} событий")
+        print(f"Загружено {events_df.select(pl.len()).collect().item()} событий")
         
-        print("\nРасчет метрик пользователей...")
-        user_metrics = self.profile_engine.calculate_user_metrics(
+        print("\nРасчет метрик пользователей и аффинити к категориям...")
+        user_metrics_lf, category_affinity_lf = self.profile_engine.build_metrics(
             events_df, items_df
         )
-        
-        print("\nРасчет аффинити к категориям...")
-        category_affinity = self.profile_engine.calculate_category_affinity(
-            events_df, items_df
+        user_metrics, category_affinity = pl.collect_all(
+            [user_metrics_lf, category_affinity_lf], engine='streaming'
         )
         
         print("\nСоздание профилей...")
-        profiles = {}
         
-        # Преобразуем в словарь для удобства
-        metrics_dict = user_metrics.to_dicts()
-        affinity_dict = {}
+        # Классификация пользователей одним векторным проходом
+        user_metrics = user_metrics.head(1000).with_columns(  # Ограничение для демо
+            self.profile_engine.classification_exprs()
+        )
         
-        for row in category_affinity.to_dicts():
-            user_id = row['user_id']
-            category = row['category']
-            score = row['affinity_score']
-            
-            if user_id not in affinity_dict:
-                affinity_dict[user_id] = {}
-            affinity_dict[user_id][category] = score
-        
-        # Создаем профили
-        for metrics_row in metrics_dict[:1000]:  # Ограничение для демо
-            user_id = metrics_row['user_id']
-            user_affinity = affinity_dict.get(user_id, {})
-            
-            profile = self.profile_engine.create_user_profile(
-                user_id, metrics_row, user_affinity
-            )
-            profiles[user_id] = profile
+        # Аффинити пользователя — два параллельных списка (категории и доли)
+        # и битовая маска категорий правил (категории в группе уникальны: сумма бит = OR)
+        affinity_by_user = category_affinity.group_by('user_id').agg([
+            pl.col('category').alias('affinity_categories'),
+            pl.col('affinity_score').alias('affinity_scores'),
+            pl.col('category').cast(pl.String)
+            .replace_strict(self.product_matcher.category_bits, default=0, return_dtype=pl.UInt64)
+            .sum().alias('active_category_mask')
+        ])
+        
+        # Профили остаются колоночными; UserProfile собирается только по запросу (get_profile)
+        profiles = (
+            user_metrics.join(affinity_by_user, on='user_id', how='left')
+            .with_columns(pl.col('user_id').cast(pl.String))
+            .select(PROFILE_COLUMNS)
+        )
         
-        print(f"\nСоздано {len(profiles)} профилей пользователей")
+        print(f"\nСоздано {profiles.height} профилей пользователей")
         return profiles
     
+    def get_profile(self, profiles: pl.DataFrame, user_id: str) -> UserProfile:
+        """Профиль одного пользователя из фрейма профилей (для вывода и API)"""
+        metrics_row = profiles.filter(pl.col('user_id') == user_id).row(0, named=True)
+        user_affinity = dict(zip(
+            metrics_row['affinity_categories'] or [], metrics_row['affinity_scores'] or []
+        ))
+        return self.profile_engine.create_user_profile(user_id, metrics_row, user_affinity)
+    
     def generate_recommendations(
         self,
-        user_profiles: Dict[str, UserProfile],
+        user_profiles: pl.DataFrame,
         top_n: int = 5
     ) -> Dict[str, List[Tuple[str, float]]]:
         """Генерация рекомендаций для всех пользователей"""
         
-        recommendations = {}
+        if user_profiles.is_empty():
+            return {}
+        
+        # Скоринг всех пользователей по всем продуктам матричными операциями, по чанкам строк
+        # в потоках: numpy отпускает GIL внутри ufunc/matmul, результаты пишутся в общий out
+        scores = np.empty((user_profiles.height, len(self.product_matcher.product_names)), dtype=np.float64)
+        top_idx = np.empty((user_profiles.height, min(top_n, scores.shape[1])), dtype=np.int64)
+        n_chunks = max(1, min(os.cpu_count() or 1, user_profiles.height // self.SCORING_CHUNK_ROWS))
+        bounds = np.linspace(0, user_profiles.height, n_chunks + 1, dtype=np.int64)
         
-        for user_id, profile in user_profiles.items():
-            recs = self.product_matcher.recommend_products(profile, top_n)
-            recommendations[user_id] = recs
+        def score_chunk(start, end):
+            chunk_scores = scores[start:end]
+            self.product_matcher.score_frame(user_profiles.slice(start, end - start), out=chunk_scores)
+            top_idx[start:end] = self._top_n_indices(chunk_scores, top_n)
+        
+        if n_chunks == 1:
+            score_chunk(0, user_profiles.height)
+        else:
+            with ThreadPoolExecutor(max_workers=n_chunks) as pool:
+                list(pool.map(score_chunk, bounds[:-1], bounds[1:]))
+        product_names = self.product_matcher.product_names
+        
+        recommendations = {}
+        for user_id, row_scores, row_idx in zip(user_profiles.get_column('user_id'), scores, top_idx):
+            recommendations[user_id] = [(product_names[i], float(row_scores[i])) for i in row_idx]
         
         return recommendations
     
+    @staticmethod
+    def _top_n_indices(scores: np.ndarray, top_n: int) -> np.ndarray:
+        """Индексы топ-N продуктов в каждой строке по убыванию скора (NaN — в конце)"""
+        n_users, n_products = scores.shape
+        # NaN не равен ни одному порогу и выпал бы из отбора: ранжируем его как -inf
+        scores = np.where(np.isnan(scores), -np.inf, scores)
+        if top_n < n_products:
+            # N-й по величине скор за O(P); из равных ему берутся продукты с меньшим индексом
+            kth = -np.partition(-scores, top_n - 1, axis=1)[:, top_n - 1:top_n]
+            above = scores > kth
+            tied = scores == kth
+            free_slots = top_n - above.sum(axis=1, keepdims=True)
+            chosen = above | (tied & (np.cumsum(tied, axis=1) <= free_slots))
+            candidates = np.nonzero(chosen)[1].reshape(n_users, top_n)
+        else:
+            candidates = np.broadcast_to(np.arange(n_products), scores.shape)
+        
+        # Внутри строки: по убыванию скора, при равенстве — по порядку продуктов
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.lexsort((candidates, -candidate_scores), axis=1)
+        return np.take_along_axis(candidates, order, axis=1)
+    
     def run_full_pipeline(self, limit_files: int = 5):
         """Запуск полного пайплайна"""
         
@@ -608,7 +970,7 @@ class RecommendationSystem:
         print("=" * 60)
         
         for i, (user_id, recs) in enumerate(list(recommendations.items())[:5]):
-            profile = profiles[user_id]
+            profile = self.get_profile(profiles, user_id)
             
             print(f"\n{'─' * 60}")
             print(f"Пользователь: {user_id}")
@@ -639,7 +1001,7 @@ class RecommendationSystem:
         print("\n" + "=" * 60)
         print("СТАТИСТИКА СИСТЕМЫ")
         print("=" * 60)
-        print(f"Всего пользователей: {len(profiles)}")
+        print(f"Всего пользователей: {profiles.height}")
         print(f"Всего рекомендаций: {sum(len(r) for r in recommendations.values())}")
         
         # Покрытие продуктов
@@ -123,8 +123,11 @@ def main():
     # Создаем папку results если нет
     os.makedirs("results", exist_ok=True)
     
-    # Сохраняем рекомендации
-    recommendations.write_parquet(f"results/recommendations_{timestamp}.parquet")
+    # Сохраняем рекомендации потоково, по row group за раз (статистика для pushdown при чтении)
+    recommendations.lazy().sink_parquet(
+        f"results/recommendations_{timestamp}.parquet",
+        compression="zstd", row_group_size=262_144, statistics=True
+    )
     
     # Сохраняем метрики
     with open(f"results/metrics_{timestamp}.json", 'w', encoding='utf-8') as f:
@@ -3,6 +3,12 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def list_event_files(events_path):
+    """Отсортированный список файлов событий: детерминированный выбор файла, листинг один раз"""
+    return sorted(os.listdir(events_path))
 
 def analyze_all_domains():
     print("🔍 ПОЛНЫЙ АНАЛИЗ ВСЕХ ДАННЫХ...")
@@ -30,7 +36,7 @@ def analyze_all_domains():
                 # Для marketplace, offers, retail
                 events_path = f'{base_path}/{domain}/events'
                 if os.path.exists(events_path):
-                    files = os.listdir(events_path)
+                    files = list_event_files(events_path)
                     sample_file = files[0]
                     data = pd.read_parquet(f'{events_path}/{sample_file}')
                     print(f"✅ {domain} события загружены из {sample_file}")
@@ -81,14 +87,15 @@ def compare_user_overlap():
         try:
             events_path = f'{base_path}/{domain}/events'
             if os.path.exists(events_path):
-                files = os.listdir(events_path)
+                files = list_event_files(events_path)
                 sample_file = files[0]
-                data = pd.read_parquet(f'{events_path}/{sample_file}')
+                # Для пересечений нужен только user_id
+                data = pd.read_parquet(f'{events_path}/{sample_file}', columns=['user_id'], engine='pyarrow')
                 
-                if 'user_id' in data.columns:
-                    users = set(data['user_id'].unique())
-                    user_sets[domain] = users
-                    print(f"👥 {domain}: {len(users)} пользователей")
+                # Отсортированный массив уникальных id вместо Python set
+                users = np.unique(data['user_id'].to_numpy())
+                user_sets[domain] = users
+                print(f"👥 {domain}: {len(users)} пользователей")
                 
         except Exception as e:
             print(f"❌ Ошибка {domain}: {e}")
@@ -101,7 +108,7 @@ def compare_user_overlap():
         for i in range(len(domains_list)):
             for j in range(i+1, len(domains_list)):
                 domain1, domain2 = domains_list[i], domains_list[j]
-                intersection = user_sets[domain1] & user_sets[domain2]
+                intersection = np.intersect1d(user_sets[domain1], user_sets[domain2], assume_unique=True)
                 print(f"   {domain1} ∩ {domain2}: {len(intersection)} пользователей")
 
 if __name__ == "__main__":
@@ -1,7 +1,13 @@
 # src/02_features_enhanced.py
 import pandas as pd
+import polars as pl
 import numpy as np
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import glob
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from tqdm import tqdm
 
 # Расширенный список продуктов банка
@@ -18,18 +24,45 @@ BANK_PRODUCTS_ENHANCED = {
     'pension_card': 'Пенсионная карта'
 }
 
-def load_sample_users(events_path, max_users=5000):
+# Размер батча при потоковом чтении событий: крупные батчи снижают накладные расходы на батч
+EVENT_BATCH_SIZE = 65536
+
+# Открытые parquet-файлы: футер с метаданными разбирается один раз на путь
+_PARQUET_FILES: dict[str, pq.ParquetFile] = {}
+
+def open_parquet(path):
+    """pq.ParquetFile из кэша; pre_buffer объединяет соседние column chunk'и в одно чтение"""
+    if path not in _PARQUET_FILES:
+        _PARQUET_FILES[path] = pq.ParquetFile(path, pre_buffer=True, buffer_size=1 << 20)
+    return _PARQUET_FILES[path]
+
+@lru_cache(maxsize=None)
+def list_event_files(base_path, domain):
+    """Отсортированный список parquet-файлов событий домена (каталог листается один раз)"""
+    return tuple(sorted(glob.glob(f'{base_path}/{domain}/events/*.pq')))
+
+def read_user_ids(file):
+    """Уникальные user_id файла событий.
+    
+    Файл читается потоком батчей по row group'ам, а не материализуется целиком.
+    """
+    users = set()
+    for batch in open_parquet(file).iter_batches(batch_size=EVENT_BATCH_SIZE, columns=['user_id']):
+        users.update(pc.unique(batch.column(0)).to_pylist())
+    return users
+
+def load_sample_users(files, max_users=5000):
     """Загружаем пользователей из файлов"""
     users = set()
-    files = os.listdir(events_path)[:3]  # 3 файла
     
-    for file in tqdm(files, desc="Загрузка пользователей"):
-        try:
-            df = pd.read_parquet(f'{events_path}/{file}')
-            if 'user_id' in df.columns:
-                users.update(df['user_id'].unique())
-        except Exception as e:
-            print(f"⚠️ Ошибка загрузки {file}: {e}")
+    # Чтение и распаковка файлов идут в потоках (pyarrow отпускает GIL), объединение — по мере готовности
+    with ThreadPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1) or 1) as executor:
+        futures = {executor.submit(read_user_ids, file): file for file in files}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Загрузка пользователей"):
+            try:
+                users.update(future.result())
+            except Exception as e:
+                print(f"⚠️ Ошибка загрузки {futures[future]}: {e}")
     
     return list(users)[:max_users]
 
@@ -39,38 +72,42 @@ def create_enhanced_features():
     
     base_path = 'data/dataset/small'
     
-    # Загружаем пользователей
-    market_users = load_sample_users(f'{base_path}/marketplace/events')
-    features_data = []
+    # Каталоги событий листаются один раз, дальше списки файлов передаются вниз
+    event_files = {domain: list_event_files(base_path, domain) for domain in DOMAIN_FEATURE_BUILDERS}
     
-    for user_id in tqdm(market_users[:2000], desc="Расширенные фичи"):
-        try:
-            user_features = {'user_id': user_id}
-            
-            # Marketplace фичи
-            market_features = get_marketplace_features_enhanced(user_id, base_path)
-            user_features.update(market_features)
-            
-            # Offers фичи
-            offers_features = get_offers_features_enhanced(user_id, base_path)
-            user_features.update(offers_features)
-            
-            # Retail фичи
-            retail_features = get_retail_features_enhanced(user_id, base_path)
-            user_features.update(retail_features)
-            
-            features_data.append(user_features)
-            
-        except Exception as e:
-            continue
+    # Загружаем пользователей
+    market_users = load_sample_users(event_files['marketplace'][:3])  # 3 файла
+    user_ids = market_users[:2000]
     
-    features_df = pd.DataFrame(features_data)
+    # Фичи каждого домена — один ленивый group_by по событиям домена, все домены в одном плане.
+    # Общий кэш строк: категориальные user_id согласованы между доменами для join
+    with pl.StringCache():
+        users_lf = pl.LazyFrame({'user_id': user_ids})
+        user_id_dtype = users_lf.collect_schema()['user_id']
+        features_lf = strings_to_categorical(users_lf, ['user_id'])
+        for domain in DOMAIN_FEATURE_BUILDERS:
+            features_lf = features_lf.join(build_features_table(domain, event_files[domain], user_ids), on='user_id', how='left')
+        
+        # Пользователи без событий в домене получают нулевые фичи
+        features_df = (
+            features_lf.fill_null(0)
+            .with_columns(pl.col('user_id').cast(user_id_dtype))  # исходный тип user_id (строка или число)
+            .collect(engine='streaming')
+            .to_pandas()
+        )
     
     # Создаем расширенную целевую переменную
     features_df = create_enhanced_target(features_df)
     
-    # Сохраняем
-    features_df.to_parquet('user_features_enhanced.pq', index=False)
+    # Узкие типы после расчета таргета: пороги считаются в исходной точности
+    features_df = downcast_features(features_df)
+    
+    # Сохраняем один раз все агрегаты; train/test делится уже при обучении
+    features_df.to_parquet(
+        'user_features_enhanced.pq', index=False, engine='pyarrow',
+        compression='zstd', compression_level=3, row_group_size=65536,
+        use_dictionary=True, write_statistics=True  # статистики row group'ов для pushdown при чтении
+    )
     
     print(f"💾 Сохранено {len(features_df)} пользователей с 10 категориями")
     print(f"📊 Распределение:")
@@ -78,179 +115,187 @@ def create_enhanced_features():
     
     return features_df
 
-def get_marketplace_features_enhanced(user_id, base_path):
+def scan_domain_events(files, columns, user_ids=None):
+    """Ленивое сканирование файлов событий домена.
+    
+    Проекция колонок и фильтр по user_ids проталкиваются в чтение parquet.
+    """
+    events = pl.scan_parquet(list(files)).select(columns)
+    if user_ids is not None:
+        events = events.filter(pl.col('user_id').is_in(list(user_ids)))
+    
+    # Строковые ключи и справочники -> Categorical: group_by и сравнения по u32-кодам
+    return strings_to_categorical(events, [column for column in CATEGORICAL_COLUMNS if column in columns])
+
+def strings_to_categorical(frame, columns):
+    """Строковые колонки -> pl.Categorical; числовые (например, целочисленные user_id) не трогаем"""
+    schema = frame.collect_schema()
+    return frame.with_columns([
+        pl.col(column).cast(pl.Categorical) for column in columns if schema.get(column) == pl.String
+    ])
+
+def build_features_table(domain, files, user_ids=None):
+    """Таблица фичей домена (LazyFrame) по первым файлам из files: одна строка на user_id"""
+    n_files, columns, build_features = DOMAIN_FEATURE_BUILDERS[domain]
+    return build_features(scan_domain_events(files[:n_files], columns, user_ids))
+
+def count_value(column, *values):
+    """Число событий пользователя со значением column из values.
+    
+    Для Categorical литералы сопоставляются с кодами один раз, дальше сравниваются u32-коды;
+    одно значение — прямое сравнение без построения множества is_in.
+    """
+    if len(values) == 1:
+        return (pl.col(column) == values[0]).sum()
+    return pl.col(column).is_in(list(values)).sum()
+
+def safe_ratio(numerator, denominator):
+    """numerator / max(1, denominator)"""
+    return pl.col(numerator) / pl.max_horizontal(pl.col(denominator), pl.lit(1))
+
+# Интерес -> регулярное выражение по item_id (упрощенный анализ интересов)
+INTEREST_PATTERNS = {
+    'tech_interest': '(?i)phone|mac|samsung|техник',
+    'home_interest': '(?i)home|house|мебель|кухн',
+    'sports_interest': '(?i)sport|спорт|фитнес',
+}
+
+def get_item_interests(events):
+    """Флаги интересов по словарю уникальных item_id (регулярки не гоняются по каждому событию)"""
+    items = pl.col('item_id').cast(pl.String)
+    return events.select(pl.col('item_id').unique()).with_columns([
+        items.str.contains(pattern).fill_null(False).alias(interest)
+        for interest, pattern in INTEREST_PATTERNS.items()
+    ])
+
+def get_marketplace_features_enhanced(events):
     """Расширенные фичи из marketplace"""
-    features = {}
-    try:
-        events_path = f'{base_path}/marketplace/events'
-        files = os.listdir(events_path)[:2]
+    interests = list(INTEREST_PATTERNS)
+    events = events.join(get_item_interests(events), on='item_id', how='left')
+    
+    features = events.group_by('user_id').agg([
+        # Базовые фичи
+        pl.len().alias('market_events'),
+        pl.col('item_id').n_unique().alias('market_unique_items'),
         
-        all_user_events = []
-        for file in files:
-            df = pd.read_parquet(f'{events_path}/{file}')
-            user_events = df[df['user_id'] == user_id]
-            all_user_events.append(user_events)
+        # Действия
+        count_value('action_type', 'view').alias('market_views'),
+        count_value('action_type', 'click', 'clickout').alias('market_clicks'),
+        count_value('action_type', 'like').alias('market_likes'),
         
-        if all_user_events:
-            user_data = pd.concat(all_user_events, ignore_index=True)
-            
-            # Базовые фичи
-            features['market_events'] = len(user_data)
-            features['market_unique_items'] = user_data['item_id'].nunique()
-            
-            # Действия
-            action_counts = user_data['action_type'].value_counts()
-            features['market_views'] = action_counts.get('view', 0)
-            features['market_clicks'] = action_counts.get('click', 0) + action_counts.get('clickout', 0)
-            features['market_likes'] = action_counts.get('like', 0)
-            
-            # Поддомены
-            subdomain_counts = user_data['subdomain'].value_counts()
-            features['market_u2i'] = subdomain_counts.get('u2i', 0)
-            features['market_search'] = subdomain_counts.get('search', 0)
-            features['market_catalog'] = subdomain_counts.get('catalog', 0)
-            
-            # Новые фичи для расширенной классификации
-            features['engagement_ratio'] = features['market_clicks'] / max(1, features['market_views'])
-            features['diversity_ratio'] = features['market_unique_items'] / max(1, features['market_events'])
-            
-            # Анализ интересов по item_id (упрощенный)
-            items = user_data['item_id'].astype(str)
-            features['tech_interest'] = items.str.contains('phone|mac|samsung|техник', case=False, na=False).sum()
-            features['home_interest'] = items.str.contains('home|house|мебель|кухн', case=False, na=False).sum()
-            features['sports_interest'] = items.str.contains('sport|спорт|фитнес', case=False, na=False).sum()
-            
-            # Нормализуем интересы
-            total_interest = features['tech_interest'] + features['home_interest'] + features['sports_interest']
-            if total_interest > 0:
-                features['tech_interest_ratio'] = features['tech_interest'] / total_interest
-                features['home_interest_ratio'] = features['home_interest'] / total_interest
-                features['sports_interest_ratio'] = features['sports_interest'] / total_interest
-            else:
-                features['tech_interest_ratio'] = 0
-                features['home_interest_ratio'] = 0
-                features['sports_interest_ratio'] = 0
-    
-    except Exception as e:
-        # Заполняем значения по умолчанию
-        features.update({
-            'market_events': 0, 'market_unique_items': 0, 'market_views': 0,
-            'market_clicks': 0, 'market_likes': 0, 'market_u2i': 0,
-            'market_search': 0, 'market_catalog': 0, 'engagement_ratio': 0,
-            'diversity_ratio': 0, 'tech_interest_ratio': 0, 'home_interest_ratio': 0,
-            'sports_interest_ratio': 0
-        })
+        # Поддомены
+        count_value('subdomain', 'u2i').alias('market_u2i'),
+        count_value('subdomain', 'search').alias('market_search'),
+        count_value('subdomain', 'catalog').alias('market_catalog'),
+        
+        # Анализ интересов по item_id (упрощенный)
+        *[pl.col(interest).sum() for interest in interests],
+    ])
     
-    return features
+    # Новые фичи для расширенной классификации и нормализованные интересы
+    total_interest = pl.sum_horizontal(interests)
+    return features.with_columns([
+        safe_ratio('market_clicks', 'market_views').alias('engagement_ratio'),
+        safe_ratio('market_unique_items', 'market_events').alias('diversity_ratio'),
+    ] + [
+        pl.when(total_interest > 0).then(pl.col(interest) / total_interest).otherwise(0.0).alias(f'{interest}_ratio')
+        for interest in interests
+    ])
 
-def get_offers_features_enhanced(user_id, base_path):
+def get_offers_features_enhanced(events):
     """Расширенные фичи из offers"""
-    features = {}
-    try:
-        events_path = f'{base_path}/offers/events'
-        files = os.listdir(events_path)[:2]
+    features = events.group_by('user_id').agg([
+        pl.len().alias('offers_seen'),
+        pl.col('item_id').n_unique().alias('offers_unique'),
         
-        all_user_events = []
-        for file in files:
-            df = pd.read_parquet(f'{events_path}/{file}')
-            user_events = df[df['user_id'] == user_id]
-            all_user_events.append(user_events)
-        
-        if all_user_events:
-            user_data = pd.concat(all_user_events, ignore_index=True)
-            
-            features['offers_seen'] = len(user_data)
-            features['offers_unique'] = user_data['item_id'].nunique()
-            
-            action_counts = user_data['action_type'].value_counts()
-            features['offers_seen_count'] = action_counts.get('seen', 0)
-            features['offers_shown'] = action_counts.get('offer_shown', 0)
-            features['offers_redirect'] = action_counts.get('redirect_to_partner', 0)
-            features['offers_liked'] = action_counts.get('like', 0)
-            features['offers_engagement'] = features['offers_shown'] + features['offers_redirect'] + features['offers_liked']
-            
-            # Новые метрики вовлеченности
-            features['offers_engagement_ratio'] = features['offers_engagement'] / max(1, features['offers_seen'])
-            features['offers_response_rate'] = features['offers_redirect'] / max(1, features['offers_shown'])
-    
-    except Exception as e:
-        features.update({
-            'offers_seen': 0, 'offers_unique': 0, 'offers_seen_count': 0,
-            'offers_shown': 0, 'offers_redirect': 0, 'offers_liked': 0,
-            'offers_engagement': 0, 'offers_engagement_ratio': 0, 'offers_response_rate': 0
-        })
+        count_value('action_type', 'seen').alias('offers_seen_count'),
+        count_value('action_type', 'offer_shown').alias('offers_shown'),
+        count_value('action_type', 'redirect_to_partner').alias('offers_redirect'),
+        count_value('action_type', 'like').alias('offers_liked'),
+        count_value('action_type', 'offer_shown', 'redirect_to_partner', 'like').alias('offers_engagement'),
+    ])
     
-    return features
+    # Новые метрики вовлеченности
+    return features.with_columns([
+        safe_ratio('offers_engagement', 'offers_seen').alias('offers_engagement_ratio'),
+        safe_ratio('offers_redirect', 'offers_shown').alias('offers_response_rate'),
+    ])
 
-def get_retail_features_enhanced(user_id, base_path):
+def get_retail_features_enhanced(events):
     """Фичи из retail"""
-    features = {}
-    try:
-        events_path = f'{base_path}/retail/events'
-        files = os.listdir(events_path)[:1]
-        
-        user_events = []
-        for file in files:
-            df = pd.read_parquet(f'{events_path}/{file}')
-            user_df = df[df['user_id'] == user_id]
-            user_events.append(user_df)
+    features = events.group_by('user_id').agg([
+        pl.len().alias('retail_events'),
+        pl.col('item_id').n_unique().alias('retail_unique_items'),
         
-        if user_events:
-            user_data = pd.concat(user_events, ignore_index=True)
-            
-            features['retail_events'] = len(user_data)
-            features['retail_unique_items'] = user_data['item_id'].nunique()
-            
-            action_counts = user_data['action_type'].value_counts()
-            features['retail_views'] = action_counts.get('view', 0)
-            features['retail_cart_adds'] = action_counts.get('added-to-cart', 0)
-            
-            # Показатель покупательской активности
-            features['retail_purchase_intent'] = features['retail_cart_adds'] / max(1, features['retail_views'])
+        count_value('action_type', 'view').alias('retail_views'),
+        count_value('action_type', 'added-to-cart').alias('retail_cart_adds'),
+    ])
     
-    except Exception as e:
-        features.update({
-            'retail_events': 0, 'retail_unique_items': 0, 'retail_views': 0,
-            'retail_cart_adds': 0, 'retail_purchase_intent': 0
-        })
+    # Показатель покупательской активности
+    return features.with_columns(
+        safe_ratio('retail_cart_adds', 'retail_views').alias('retail_purchase_intent')
+    )
+
+# Колонки событий, хранимые как pl.Categorical
+CATEGORICAL_COLUMNS = ['user_id', 'action_type', 'subdomain']
+
+# Домен -> (число файлов событий, читаемые колонки, построитель таблицы фичей)
+DOMAIN_FEATURE_BUILDERS = {
+    'marketplace': (2, ['user_id', 'item_id', 'action_type', 'subdomain'], get_marketplace_features_enhanced),
+    'offers': (2, ['user_id', 'item_id', 'action_type'], get_offers_features_enhanced),
+    'retail': (1, ['user_id', 'item_id', 'action_type'], get_retail_features_enhanced),
+}
+
+def downcast_features(features):
+    """Счетчики -> минимальный беззнаковый тип, доли -> float32, таргет -> category (int8-коды).
     
+    user_id (в т.ч. целочисленный) сохраняет исходный тип.
+    """
+    for column in features.select_dtypes('integer').columns.drop('user_id', errors='ignore'):
+        features[column] = pd.to_numeric(features[column], downcast='unsigned')
+    for column in features.select_dtypes('float64'):
+        features[column] = features[column].astype('float32')
+    features['target_product'] = features['target_product'].astype('category')
     return features
 
 def create_enhanced_target(features):
     """Создаем расширенную целевую переменную с 10 категориями"""
     print("🎯 Создаем 10 категорий продуктов...")
     
-    # Сбрасываем все значения
-    features['target_product'] = 'savings_account'  # значение по умолчанию
+    # Нужные колонки один раз в виде ndarray: маски считаются без промежуточных Series
+    columns = ['market_events', 'offers_engagement', 'offers_engagement_ratio', 'home_interest_ratio',
+               'engagement_ratio', 'tech_interest_ratio', 'market_clicks', 'diversity_ratio',
+               'sports_interest_ratio', 'offers_seen']
+    f = {column: features[column].to_numpy() for column in columns}
     
     # СЛОЖНАЯ ЛОГИКА ДЛЯ 10 КАТЕГОРИЙ:
     conditions = [
         # 1. ПОТРЕБИТЕЛЬСКИЙ КРЕДИТ - высокая активность + вовлеченность
-        (features['market_events'] > 80) & (features['offers_engagement'] > 8),
+        (f['market_events'] > 80) & (f['offers_engagement'] > 8),
         
         # 2. РЕФИНАНСИРОВАНИЕ - средняя активность + высокая вовлеченность
-        (features['market_events'] > 50) & (features['offers_engagement_ratio'] > 0.3),
+        (f['market_events'] > 50) & (f['offers_engagement_ratio'] > 0.3),
         
         # 3. ИПОТЕКА - интерес к товарам для дома
-        (features['home_interest_ratio'] > 0.6) & (features['market_events'] > 30),
+        (f['home_interest_ratio'] > 0.6) & (f['market_events'] > 30),
         
         # 4. ПРЕМИУМ КАРТА - высокая активность + премиум поведение
-        (features['market_events'] > 100) & (features['engagement_ratio'] > 0.1),
+        (f['market_events'] > 100) & (f['engagement_ratio'] > 0.1),
         
         # 5. КРЕДИТНАЯ КАРТА 180 - активные покупки + техника
-        (features['tech_interest_ratio'] > 0.5) & (features['market_clicks'] > 10),
+        (f['tech_interest_ratio'] > 0.5) & (f['market_clicks'] > 10),
         
         # 6. ЗАРПЛАТНАЯ КАРТА - стабильная умеренная активность
-        (features['market_events'].between(30, 100)) & (features['diversity_ratio'] > 0.3),
+        ((f['market_events'] >= 30) & (f['market_events'] <= 100)) & (f['diversity_ratio'] > 0.3),
         
         # 7. СПОРТИВНАЯ КАРТА - интерес к спорту
-        (features['sports_interest_ratio'] > 0.4) & (features['market_events'] > 20),
+        (f['sports_interest_ratio'] > 0.4) & (f['market_events'] > 20),
         
         # 8. ПЕНСИОННАЯ КАРТА - низкая активность
-        (features['market_events'] < 20) & (features['offers_seen'] < 5),
+        (f['market_events'] < 20) & (f['offers_seen'] < 5),
         
         # 9. ВКЛАД - умеренная активность + низкая вовлеченность
-        (features['market_events'].between(20, 60)) & (features['offers_engagement_ratio'] < 0.1),
+        ((f['market_events'] >= 20) & (f['market_events'] <= 60)) & (f['offers_engagement_ratio'] < 0.1),
     ]
     
     choices = [
@@ -266,7 +311,9 @@ def create_enhanced_target(features):
     ]
     
     # 10. СБЕРЕГАТЕЛЬНЫЙ СЧЕТ - значение по умолчанию (не включаем в conditions)
-    features['target_product'] = np.select(conditions, choices, default='savings_account')
+    # Код класса int8 по первому выполненному условию, метки подставляются одним take
+    codes = np.select(conditions, np.arange(len(choices), dtype=np.int8), default=np.int8(len(choices)))
+    features['target_product'] = np.take(np.array(choices + ['savings_account']), codes)
     
     return features
 
@@ -1,22 +1,69 @@
 # src/03_train_enhanced.py
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
 import xgboost as xgb
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score, confusion_matrix
-from sklearn.preprocessing import LabelEncoder
-from sklearn.utils import class_weight
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pickle
 import os
+import shutil
+
+def xgb_device():
+    """'cuda', если xgboost собран с CUDA и в системе есть GPU, иначе 'cpu'"""
+    if xgb.build_info().get('USE_CUDA') and shutil.which('nvidia-smi'):
+        return 'cuda'
+    return 'cpu'
+
+def save_confusion_matrix(cm, classes, path):
+    """Тепловая карта матрицы ошибок на чистом matplotlib"""
+    import matplotlib.pyplot as plt
+    
+    fig, ax = plt.subplots(figsize=(12, 10))
+    ax.imshow(cm, cmap='Blues')
+    for i, j in np.ndindex(cm.shape):
+        ax.text(j, i, cm[i, j], ha='center', va='center',
+                color='white' if cm[i, j] > cm.max() / 2 else 'black')
+    ax.set_xticks(range(len(classes)), classes, rotation=45)
+    ax.set_yticks(range(len(classes)), classes, rotation=0)
+    ax.set_title('Матрица ошибок - 10 категорий')
+    ax.set_xlabel('Предсказание')
+    ax.set_ylabel('Истина')
+    fig.tight_layout()
+    fig.savefig(path, dpi=100, bbox_inches='tight')
+    plt.close('all')
+
+def save_confusion_matrix_quick(cm, path, size=400):
+    """Матрица ошибок как картинка в оттенках серого (клетка на класс), без matplotlib"""
+    from PIL import Image
+    
+    pixels = (cm / max(cm.max(), 1) * 255).astype(np.uint8)
+    Image.fromarray(pixels).resize((size, size), Image.NEAREST).save(path)
+
+def report_model(y_test, y_pred, classes):
+    """Classification report и (при EMIT_PLOTS) матрица ошибок по готовым предсказаниям"""
+    print(f"📈 Classification Report:")
+    print(classification_report(y_test, y_pred, target_names=classes))
+    
+    # Подписанный график matplotlib — только когда явно запрошен, иначе быстрая картинка через PIL
+    cm = confusion_matrix(y_test, y_pred)
+    if os.environ.get('EMIT_PLOTS'):
+        save_confusion_matrix(cm, classes, 'confusion_matrix_10_classes.png')
+    else:
+        save_confusion_matrix_quick(cm, 'confusion_matrix_10_classes.png')
+    print("💾 Матрица ошибок сохранена как confusion_matrix_10_classes.png")
 
 def train_enhanced_model():
     print("🤖 ОБУЧАЕМ ML С 10 КАТЕГОРИЯМИ...")
     
     # 1. Загружаем расширенные фичи
     print("📥 Загружаем расширенные фичи...")
-    features_df = pd.read_parquet('user_features_enhanced.pq')
+    # user_id для обучения не нужен — читаем только остальные колонки.
+    # self_destruct освобождает Arrow-буферы по мере конвертации: пик памяти ~1 копия вместо двух
+    feature_columns = [name for name in pq.read_schema('user_features_enhanced.pq').names if name != 'user_id']
+    features_df = (
+        pq.read_table('user_features_enhanced.pq', columns=feature_columns, use_threads=True)
+        .to_pandas(split_blocks=True, self_destruct=True)
+    )
     
     print(f"📊 Данные для обучения:")
     print(f"- Пользователей: {len(features_df)}")
@@ -29,86 +76,93 @@ def train_enhanced_model():
     X = features_df.drop(['user_id', 'target_product'], axis=1, errors='ignore')
     y = features_df['target_product']
     
-    # Заполняем пропуски
-    X = X.fillna(0)
+    # Заполняем пропуски; все фичи — счетчики и доли, xgboost работает с ними во float32
+    X = X.fillna(0).astype(np.float32)
     
     print(f"📈 Фичи для обучения: {len(X.columns)}")
     
     # 3. Кодируем целевую переменную (10 классов!)
-    label_encoder = LabelEncoder()
-    y_encoded = label_encoder.fit_transform(y)
+    # Коды категорий вместо LabelEncoder: классы отсортированы так же, декодирование — classes[codes]
+    target = pd.Categorical(y).remove_unused_categories()
+    y_encoded = target.codes.astype(np.int32)
+    classes = target.categories.to_numpy().astype(str)
     
-    print(f"🎯 Классы ({len(label_encoder.classes_)}): {label_encoder.classes_}")
+    print(f"🎯 Классы ({len(classes)}): {classes}")
     
     # 4. Балансируем классы (важно для многоклассовой классификации)
-    class_weights = class_weight.compute_sample_weight(
-        'balanced',
-        y_encoded
-    )
+    # Вес класса 'balanced' как в sklearn: n / (n_classes * count); строкам раздается по коду класса
+    class_counts = np.bincount(y_encoded)
+    class_weights = (len(y_encoded) / (len(class_counts) * class_counts)).astype(np.float32)
     
     # 5. Разделяем на train/test
     X_train, X_test, y_train, y_test = train_test_split(
         X, y_encoded, test_size=0.2, random_state=42, stratify=y_encoded
     )
     
-    print(f"📚 Обучающая выборка: {len(X_train)}")
+    # Валидация для early stopping отделяется от train: тест не участвует в выборе числа деревьев
+    X_fit, X_val, y_fit, y_val = train_test_split(
+        X_train, y_train, test_size=0.1, random_state=42, stratify=y_train
+    )
+    
+    print(f"📚 Обучающая выборка: {len(X_fit)}")
+    print(f"🔎 Валидационная выборка (early stopping): {len(X_val)}")
     print(f"🧪 Тестовая выборка: {len(X_test)}")
     
     # 6. Обучаем XGBoost с настройками для многоклассовой классификации
     print("\n🚀 Обучаем XGBoost для 10 категорий...")
     
-    model = xgb.XGBClassifier(
-        n_estimators=150,           # Больше деревьев для сложной классификации
-        max_depth=8,                # Глубже для сложных паттернов
-        learning_rate=0.1,
-        random_state=42,
-        eval_metric='mlogloss',     # Метрика для многоклассовой классификации
-        verbosity=1,
-        scale_pos_weight=1,
-        subsample=0.8,
-        colsample_bytree=0.8
+    # Признаки квантуются в бины один раз (QuantileDMatrix), деревья строятся по гистограммам.
+    train_matrix = X_fit.to_numpy()
+    test_matrix = X_test.to_numpy()
+    dtrain = xgb.QuantileDMatrix(
+        train_matrix, label=y_fit, max_bin=256,
+        weight=class_weights[y_fit],  # Веса для балансировки, по классу каждой строки train
+        feature_names=X.columns.tolist()
     )
-    
-    model.fit(
-        X_train, y_train,
-        eval_set=[(X_test, y_test)],
-        verbose=10,
-        sample_weight=class_weights[:len(X_train)]  # Веса для балансировки
+    dval = xgb.QuantileDMatrix(X_val.to_numpy(), label=y_val, ref=dtrain,
+                               feature_names=X.columns.tolist())
+    
+    params = {
+        'objective': 'multi:softprob',
+        'num_class': len(classes),
+        'tree_method': 'hist',
+        'device': xgb_device(),         # GPU-гистограммы при наличии CUDA
+        'max_depth': 8,                 # Глубже для сложных паттернов
+        'eta': 0.1,
+        'subsample': 0.8,
+        'colsample_bytree': 0.8,
+        'eval_metric': 'mlogloss',      # Метрика для многоклассовой классификации
+        'seed': 42
+    }
+    
+    model = xgb.train(
+        params, dtrain,
+        num_boost_round=150,            # Больше деревьев для сложной классификации
+        evals=[(dval, 'val')],
+        early_stopping_rounds=20,       # Не достраиваем деревья, когда mlogloss перестал падать
+        verbose_eval=10
     )
     
     # 7. Оценка модели
     print("\n📊 ОЦЕНКА КАЧЕСТВА МОДЕЛИ (10 КАТЕГОРИЙ):")
     
-    y_pred = model.predict(X_test)
+    y_pred = model.inplace_predict(test_matrix, iteration_range=(0, model.best_iteration + 1)).argmax(axis=1)
     accuracy = accuracy_score(y_test, y_pred)
     
     print(f"🎯 Точность: {accuracy:.2%}")
-    print(f"📈 Classification Report:")
-    print(classification_report(y_test, y_pred, target_names=label_encoder.classes_))
     
-    # 8. Матрица ошибок
-    cm = confusion_matrix(y_test, y_pred)
-    plt.figure(figsize=(12, 10))
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', 
-                xticklabels=label_encoder.classes_,
-                yticklabels=label_encoder.classes_)
-    plt.title('Матрица ошибок - 10 категорий')
-    plt.xlabel('Предсказание')
-    plt.ylabel('Истина')
-    plt.xticks(rotation=45)
-    plt.yticks(rotation=0)
-    plt.tight_layout()
-    plt.savefig('confusion_matrix_10_classes.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    print("💾 Матрица ошибок сохранена как confusion_matrix_10_classes.png")
+    # 8. Подробный отчет и матрица ошибок — только по запросу, в обычном переобучении не нужны
+    if os.environ.get('PSB_REPORT'):
+        report_model(y_test, y_pred, classes)
     
     # 9. Важность признаков
     print("\n🔝 ВАЖНОСТЬ ПРИЗНАКОВ:")
-    feature_importance = model.feature_importances_
+    # Как feature_importances_ в XGBClassifier: нормированный gain, неиспользованные признаки — 0
+    gain = model.get_score(importance_type='gain')
+    feature_importance = np.array([gain.get(feature, 0.0) for feature in X.columns])
     importance_df = pd.DataFrame({
         'feature': X.columns,
-        'importance': feature_importance
+        'importance': feature_importance / max(feature_importance.sum(), 1e-12)
     }).sort_values('importance', ascending=False)
     
     print(importance_df.head(15))
@@ -119,24 +173,19 @@ def train_enhanced_model():
     
     model.save_model('models/xgboost_model_enhanced.json')
     
-    with open('models/label_encoder_enhanced.pkl', 'wb') as f:
-        pickle.dump(label_encoder, f)
-    
-    with open('models/feature_names_enhanced.pkl', 'wb') as f:
-        pickle.dump(X.columns.tolist(), f)
+    # Без pickle: классы — .npy (np.load(..., mmap_mode='r')), имена фичей — колонка parquet
+    np.save('models/target_classes_enhanced.npy', classes)
+    pd.DataFrame({'feature': X.columns}).to_parquet('models/feature_names_enhanced.pq', index=False)
     
     # 11. Примеры предсказаний
     print("\n👀 ПРИМЕРЫ ПРЕДСКАЗАНИЙ (10 КАТЕГОРИЙ):")
     sample_indices = np.random.choice(len(X_test), 8, replace=False)
     
-    for idx in sample_indices:
-        user_features = X_test.iloc[idx:idx+1]
-        true_label = y_test[idx]
-        pred_label = y_pred[idx]
-        
-        true_product = label_encoder.inverse_transform([true_label])[0]
-        pred_product = label_encoder.inverse_transform([pred_label])[0]
-        
+    # Декодирование меток — два векторных gather вместо декодирования каждой строки
+    true_products = classes[y_test[sample_indices]]
+    pred_products = classes[y_pred[sample_indices]]
+    
+    for idx, true_product, pred_product in zip(sample_indices, true_products, pred_products):
         status = "✅" if true_product == pred_product else "❌"
         print(f"{status} Пользователь {idx}: Истина = {true_product:20} Предсказание = {pred_product}")
     
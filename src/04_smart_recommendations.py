@@ -3,116 +3,127 @@ import pandas as pd
 import numpy as np
 from bank_products import BANK_PRODUCTS
 
+# Фичи пользователя, участвующие в скоринге, в порядке колонок feature_matrix
+SCORING_FEATURES = (
+    'market_events', 'offers_engagement', 'engagement_ratio', 'consistent_activity',
+    'premium_score', 'frequent_purchases', 'big_purchases', 'home_interest',
+    'family_products', 'frequent_travel', 'sports_interest', 'healthy_lifestyle',
+)
+
+# Условия правил: имя -> (фича, операция, порог). 'flag' истинно при ненулевом значении, как в if
+INDICATORS = {
+    'active_market': ('market_events', 'gt', 50),
+    'engaged_offers': ('offers_engagement', 'gt', 5),
+    'consistent_activity': ('consistent_activity', 'flag', None),
+    'moderate_market': ('market_events', 'between', (20, 100)),
+    'low_offers': ('offers_engagement', 'lt', 3),
+    'stable_engagement': ('engagement_ratio', 'lt', 0.1),
+    'very_active_market': ('market_events', 'gt', 100),
+    'premium_interest': ('premium_score', 'gt', 0.6),
+    'frequent_purchases': ('frequent_purchases', 'flag', None),
+    'big_purchases': ('big_purchases', 'flag', None),
+    'home_interest': ('home_interest', 'gt', 0.6),
+    'family_products': ('family_products', 'flag', None),
+    'premium_affinity': ('premium_score', 'gt', 0.7),
+    'frequent_travel': ('frequent_travel', 'flag', None),
+    'sports_interest': ('sports_interest', 'gt', 0.4),
+    'healthy_lifestyle': ('healthy_lifestyle', 'flag', None),
+}
+
+# Баллы по категории продукта: категория -> [(условие, баллы)]
+CATEGORY_RULES = {
+    # Кредитные: активность, вовлеченность с банком, стабильность поведения
+    'credit': [('active_market', 20), ('engaged_offers', 25), ('consistent_activity', 15)],
+    # Сберегательные: умеренная активность, низкая вовлеченность с рисковыми продуктами, стабильное поведение
+    'savings': [('moderate_market', 30), ('low_offers', 25), ('stable_engagement', 20)],
+    # Премиум: высокая активность, интересы в премиум-сегменте, частые покупки
+    'premium': [('very_active_market', 30), ('premium_interest', 35), ('frequent_purchases', 25)],
+}
+
+# Специфические правила для отдельных продуктов: product_id -> [(условие, баллы)]
+PRODUCT_RULES = {
+    'consumer_loan': [('active_market', 30), ('big_purchases', 40)],
+    'mortgage': [('home_interest', 50), ('family_products', 30)],
+    'premium_card': [('premium_affinity', 60), ('frequent_travel', 30)],
+    'sports_card': [('sports_interest', 70), ('healthy_lifestyle', 20)],
+}
+
+MAX_SCORE = 100
+
 class SmartRecommendationEngine:
     def __init__(self):
         self.products = BANK_PRODUCTS
+        self.product_ids = list(self.products)
+        self._product_index = {product_id: j for j, product_id in enumerate(self.product_ids)}
+        
+        # Таблица баллов (продукты x условия): скоринг — одно умножение матрицы условий на нее
+        self._W = np.stack([
+            self._rule_weights(CATEGORY_RULES.get(product['category'], []))
+            + self._rule_weights(PRODUCT_RULES.get(product_id, []))
+            for product_id, product in self.products.items()
+        ])
+        self._category_W = {category: self._rule_weights(rules) for category, rules in CATEGORY_RULES.items()}
+    
+    @staticmethod
+    def _rule_weights(rules):
+        """Вектор баллов по условиям INDICATORS"""
+        weights = np.zeros(len(INDICATORS), dtype=np.int64)
+        names = list(INDICATORS)
+        for indicator, points in rules:
+            weights[names.index(indicator)] += points
+        return weights
+    
+    @staticmethod
+    def feature_vector(user_features):
+        """Фичи пользователя (dict) в порядке SCORING_FEATURES; отсутствующие — 0"""
+        return np.array([user_features.get(name, 0) for name in SCORING_FEATURES], dtype=np.float64)
+    
+    @staticmethod
+    def feature_to_indicators(features_mat):
+        """Матрица условий INDICATORS (пользователи x условия) по матрице фичей в порядке SCORING_FEATURES"""
+        features_mat = np.atleast_2d(features_mat)
+        indicators = np.empty((len(features_mat), len(INDICATORS)), dtype=np.int64)
+        for i, (feature, op, threshold) in enumerate(INDICATORS.values()):
+            values = features_mat[:, SCORING_FEATURES.index(feature)]
+            if op == 'gt':
+                indicators[:, i] = values > threshold
+            elif op == 'lt':
+                indicators[:, i] = values < threshold
+            elif op == 'between':
+                indicators[:, i] = (values >= threshold[0]) & (values <= threshold[1])
+            else:
+                indicators[:, i] = values != 0
+        return indicators
+    
+    def _user_scores(self, user_features):
+        """Баллы пользователя по всем продуктам (в порядке product_ids)"""
+        return self.score_all(self.feature_vector(user_features)[None, :])[0]
+    
+    def _category_score(self, user_features, category):
+        """Баллы категории продукта без специфических правил"""
+        indicators = self.feature_to_indicators(self.feature_vector(user_features))
+        return int(indicators[0] @ self._category_W[category])
     
     def calculate_product_score(self, user_features, product_id):
         """Рассчитываем релевантность продукта для пользователя"""
-        product = self.products[product_id]
-        score = 0
-        
-        # Базовые правила рекомендаций
-        if product['category'] == 'credit':
-            score += self.calculate_credit_score(user_features)
-        
-        elif product['category'] == 'savings':
-            score += self.calculate_savings_score(user_features)
-            
-        elif product['category'] == 'premium':
-            score += self.calculate_premium_score(user_features)
-            
-        elif product['category'] == 'credit_card':
-            score += self.calculate_credit_card_score(user_features)
-        
-        # Специфические правила для каждого продукта
-        if product_id == 'consumer_loan':
-            if user_features.get('market_events', 0) > 50:
-                score += 30
-            if user_features.get('big_purchases', False):
-                score += 40
-                
-        elif product_id == 'mortgage':
-            if user_features.get('home_interest', 0) > 0.6:
-                score += 50
-            if user_features.get('family_products', False):
-                score += 30
-                
-        elif product_id == 'premium_card':
-            if user_features.get('premium_score', 0) > 0.7:
-                score += 60
-            if user_features.get('frequent_travel', False):
-                score += 30
-                
-        elif product_id == 'sports_card':
-            if user_features.get('sports_interest', 0) > 0.4:
-                score += 70
-            if user_features.get('healthy_lifestyle', False):
-                score += 20
-        
-        return min(100, score)
+        return int(self._user_scores(user_features)[self._product_index[product_id]])
     
     def calculate_credit_score(self, user_features):
         """Скоринг для кредитных продуктов"""
-        score = 0
-        
-        # Активность
-        if user_features.get('market_events', 0) > 50:
-            score += 20
-        
-        # Вовлеченность с банком
-        if user_features.get('offers_engagement', 0) > 5:
-            score += 25
-            
-        # Стабильность поведения
-        if user_features.get('consistent_activity', False):
-            score += 15
-            
-        return score
+        return self._category_score(user_features, 'credit')
     
     def calculate_savings_score(self, user_features):
         """Скоринг для сберегательных продуктов"""
-        score = 0
-        
-        # Умеренная активность
-        if 20 <= user_features.get('market_events', 0) <= 100:
-            score += 30
-            
-        # Низкая вовлеченность с рисковыми продуктами
-        if user_features.get('offers_engagement', 0) < 3:
-            score += 25
-            
-        # Стабильное поведение
-        if user_features.get('engagement_ratio', 0) < 0.1:
-            score += 20
-            
-        return score
+        return self._category_score(user_features, 'savings')
     
     def calculate_premium_score(self, user_features):
         """Скоринг для премиум-продуктов"""
-        score = 0
-        
-        # Высокая активность
-        if user_features.get('market_events', 0) > 100:
-            score += 30
-            
-        # Интересы в премиум-сегменте
-        if user_features.get('premium_score', 0) > 0.6:
-            score += 35
-            
-        # Частые покупки
-        if user_features.get('frequent_purchases', False):
-            score += 25
-            
-        return score
+        return self._category_score(user_features, 'premium')
     
     def recommend_products(self, user_features, top_n=5):
         """Генерируем персонализированные рекомендации"""
-        scores = {}
-        
-        for product_id in self.products:
-            score = self.calculate_product_score(user_features, product_id)
-            scores[product_id] = score
+        # Все продукты скорятся одним умножением на таблицу баллов
+        scores = dict(zip(self.product_ids, self._user_scores(user_features).tolist()))
         
         # Сортируем по убыванию релевантности
         sorted_products = sorted(scores.items(), key=lambda x: x[1], reverse=True)
@@ -120,18 +131,58 @@ class SmartRecommendationEngine:
         recommendations = []
         for product_id, score in sorted_products[:top_n]:
             if score > 10:  # Минимальный порог релевантности
-                product = self.products[product_id]
-                recommendations.append({
-                    'product_id': product_id,
-                    'name': product['name'],
-                    'category': product['category'],
-                    'description': product['description'],
-                    'score': score,
-                    'match_percentage': f"{score}%"
-                })
+                recommendations.append(self._make_recommendation(product_id, score))
         
         return recommendations
     
+    def _make_recommendation(self, product_id, score):
+        """Запись рекомендации продукта"""
+        product = self.products[product_id]
+        return {
+            'product_id': product_id,
+            'name': product['name'],
+            'category': product['category'],
+            'description': product['description'],
+            'score': score,
+            'match_percentage': f"{score}%"
+        }
+    
+    def feature_matrix(self, user_features_df):
+        """Фичи скоринга в фиксированном порядке SCORING_FEATURES: матрица (пользователи x фичи).
+        
+        Отсутствующая колонка — нули, как user_features.get(name, 0).
+        """
+        matrix = np.zeros((len(user_features_df), len(SCORING_FEATURES)), order='F')
+        for i, name in enumerate(SCORING_FEATURES):
+            if name in user_features_df:
+                matrix[:, i] = user_features_df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+        return matrix
+    
+    def score_all(self, features_mat, out=None):
+        """Матрица релевантности (пользователи x продукты): условия @ таблица баллов, с потолком MAX_SCORE"""
+        indicators = self.feature_to_indicators(features_mat)
+        if out is None:
+            out = np.empty((len(indicators), len(self.product_ids)), dtype=np.int64)
+        np.matmul(indicators, self._W.T, out=out)
+        return np.minimum(out, MAX_SCORE, out=out)
+    
+    def score_users_batch(self, user_features_df, out=None):
+        """Матрица релевантности для строк user_features_df"""
+        return self.score_all(self.feature_matrix(user_features_df), out)
+    
+    def recommend_products_batch(self, user_features_df, top_n=5):
+        """Рекомендации для всех строк user_features_df (список на пользователя, как recommend_products)"""
+        scores = self.score_users_batch(user_features_df)
+        product_ids = self.product_ids
+        
+        # Стабильная сортировка: при равном score порядок продуктов тот же, что у sorted() в recommend_products
+        top_products = np.argsort(-scores, axis=1, kind='stable')[:, :top_n]
+        
+        return [
+            [self._make_recommendation(product_ids[j], int(user_scores[j])) for j in user_top if user_scores[j] > 10]
+            for user_scores, user_top in zip(scores, top_products)
+        ]
+    
     def generate_explanation(self, user_features, product):
         """Генерируем объяснение рекомендации"""
         explanations = []
@@ -3,33 +3,91 @@ import re
 from typing import Dict, List, Tuple
 from collections import Counter
 import json
+import hashlib
+import orjson
 import numpy as np
+from config.paths import PATHS
+
+# Версия формата кэша категорий: меняется вместе со структурой результата _discover_categories
+CATEGORIES_CACHE_VERSION = 2
+
+# Ключи диапазонов цен: в результате это кортежи, в JSON — списки (а inf сохраняется как null)
+RANGE_KEYS = ('range', 'price_range')
+
+
+def _restore_cached_ranges(value):
+    """Возвращает кортежи диапазонов и бесконечную верхнюю границу после чтения JSON-кэша"""
+    if isinstance(value, dict):
+        return {
+            key: tuple(float('inf') if bound is None else bound for bound in item)
+            if key in RANGE_KEYS and isinstance(item, list) else _restore_cached_ranges(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_restore_cached_ranges(item) for item in value]
+    return value
+
 
 class CategoryDiscoverer:
     def __init__(self):
         self.category_hierarchy = {}
         self.price_segments = {}
         
-    def discover_categories_from_data(self, items_df: pl.DataFrame) -> Dict:
-        """Автоматическое обнаружение категорий из данных"""
+    def discover_categories_from_data(self, items_df: pl.DataFrame, use_cache: bool = True,
+                                      top_k: int = 10) -> Dict:
+        """Автоматическое обнаружение категорий из данных (top_k — размер top_categories)"""
         print("🎯 Обнаружение категорий из данных...")
         
+        cache_file = PATHS.DATA_CACHE_DIR / f"categories_v{CATEGORIES_CACHE_VERSION}_{self._items_cache_key(items_df)}_top{top_k}.json" if use_cache else None
+        if cache_file is not None and cache_file.exists():
+            try:
+                categories = _restore_cached_ranges(orjson.loads(cache_file.read_bytes()))
+                print(f"   ♻️ Категории взяты из кэша: {cache_file}")
+                return categories
+            except Exception as e:
+                print(f"   ⚠️ Не удалось прочитать кэш категорий: {e}")
+        
+        categories = self._discover_categories(items_df, top_k)
+        
+        if cache_file is not None:
+            try:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                cache_file.write_bytes(orjson.dumps(categories, option=orjson.OPT_SERIALIZE_NUMPY))
+            except Exception as e:
+                print(f"   ⚠️ Не удалось сохранить кэш категорий: {e}")
+        
+        return categories
+    
+    def _items_cache_key(self, items_df: pl.DataFrame) -> str:
+        """Ключ кэша категорий: схема, число строк и хэш содержимого (без списочных колонок)"""
+        scalar_columns = [c for c, dtype in items_df.schema.items() if not isinstance(dtype, (pl.List, pl.Array))]
+        content_hash = items_df.select(scalar_columns).hash_rows().sum() if scalar_columns else 0
+        key = f"{items_df.height}-{scalar_columns}-{content_hash}"
+        return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+    
+    def _discover_categories(self, items_df: pl.DataFrame, top_k: int) -> Dict:
+        """Расчет категорий (без кэша)"""
         categories = {}
         
+        # Все group_by-агрегаты по товарам считаются одним collect_all по общему ленивому плану
+        stats = self._collect_group_stats(items_df)
+        
         # Анализ существующих категорий
-        if 'category' in items_df.columns:
-            categories['existing_categories'] = self._analyze_existing_categories(items_df)
+        if 'category' in stats:
+            categories['existing_categories'] = self._analyze_existing_categories(items_df, top_k, stats['category'])
         
         # Анализ брендов
-        if 'brand_id' in items_df.columns:
-            categories['brands_analysis'] = self._analyze_brands(items_df)
+        if 'brand' in stats:
+            categories['brands_analysis'] = self._analyze_brands(items_df, stats['brand'])
             
+        # Статистика цен считается один раз и используется и категоризацией, и сегментами
+        price_stats = self._get_price_stats(items_df) if 'price' in items_df.columns else None
+        
         # Автоматическая категоризация по названиям/описаниям
-        categories['auto_categories'] = self._auto_categorize_items(items_df)
+        categories['auto_categories'] = self._auto_categorize_items(items_df, stats.get('category_combo'), price_stats)
         
         # Анализ ценовых сегментов (с проверкой корректности цен)
-        if 'price' in items_df.columns:
-            price_stats = self._get_price_stats(items_df)
+        if price_stats is not None:
             if price_stats['is_valid']:
                 categories['price_segments'] = self._analyze_price_segments(items_df)
             else:
@@ -40,11 +98,12 @@ class CategoryDiscoverer:
     
     def _get_price_stats(self, items_df: pl.DataFrame) -> Dict:
         """Получение статистики цен с проверкой корректности"""
-        prices = items_df['price']
-        
-        min_price = prices.min()
-        max_price = prices.max()
-        mean_price = prices.mean()
+        # Мин/макс/среднее за один проход по колонке
+        min_price, max_price, mean_price = items_df.select([
+            pl.col('price').min().alias('min_price'),
+            pl.col('price').max().alias('max_price'),
+            pl.col('price').mean().alias('mean_price')
+        ]).row(0)
         
         # Проверка на корректность цен
         is_valid = (min_price >= 0 and max_price > 10 and mean_price > 0)
@@ -57,42 +116,76 @@ class CategoryDiscoverer:
             'issue': 'negative_prices' if min_price < 0 else 'low_prices' if max_price <= 10 else 'ok'
         }
     
-    def _analyze_existing_categories(self, items_df: pl.DataFrame) -> Dict:
-        """Анализ существующих категорий"""
-        # Фильтруем пустые категории
-        valid_items = items_df.filter(pl.col('category').is_not_null())
+    def _group_stats_queries(self, items: pl.LazyFrame, columns: List[str]) -> Dict[str, pl.LazyFrame]:
+        """Ленивые group_by-запросы по товарам: категории, бренды, категория + подкатегория"""
+        queries = {}
         
-        category_stats = (
-            valid_items.group_by('category')
-            .agg([
-                pl.count().alias('item_count'),
-                pl.col('price').mean().alias('avg_price'),
-                pl.col('price').std().alias('price_std'),
-                pl.col('subcategory').unique().alias('subcategories')
-            ])
-            .sort('item_count', descending=True)
-        )
+        if 'category' in columns:
+            queries['category'] = (
+                items.filter(pl.col('category').is_not_null())  # Фильтруем пустые категории
+                .group_by('category')
+                .agg([
+                    pl.len().alias('item_count'),
+                    pl.col('price').mean().alias('avg_price'),
+                    pl.col('price').std().alias('price_std'),
+                    pl.col('subcategory').unique().alias('subcategories')
+                ])
+                .sort('item_count', descending=True)
+            )
+        
+        if 'brand_id' in columns:
+            queries['brand'] = (
+                items.group_by('brand_id')
+                .agg([
+                    pl.len().alias('product_count'),
+                    pl.col('price').mean().alias('avg_price'),
+                    pl.col('category').unique().alias('categories')
+                ])
+                .filter(pl.col('product_count') > 5)  # Только значимые бренды
+                .sort('avg_price', descending=True)
+            )
+        
+        if 'category' in columns and 'subcategory' in columns:
+            queries['category_combo'] = (
+                items.filter(pl.col('category').is_not_null() & pl.col('subcategory').is_not_null())
+                .group_by(['category', 'subcategory'])
+                .agg([
+                    pl.len().alias('count'),
+                    pl.col('price').mean().alias('avg_price'),
+                    pl.col('price').std().alias('price_volatility')
+                ])
+            )
+        
+        return queries
+    
+    def _collect_group_stats(self, items_df: pl.DataFrame) -> Dict[str, pl.DataFrame]:
+        """Все group_by-агрегаты по товарам за один collect_all (общие узлы плана считаются один раз)"""
+        queries = self._group_stats_queries(items_df.lazy(), items_df.columns)
+        if not queries:
+            return {}
+        return dict(zip(queries, pl.collect_all(list(queries.values()), engine='streaming')))
+    
+    def _analyze_existing_categories(self, items_df: pl.DataFrame, top_k: int = 10,
+                                     category_stats: pl.DataFrame | None = None) -> Dict:
+        """Анализ существующих категорий (category_stats — готовый агрегат из _collect_group_stats)"""
+        if category_stats is None:
+            category_stats = self._collect_group_stats(items_df)['category']
+        
+        total_items_with_category = category_stats['item_count'].sum()
         
         return {
             'stats': category_stats.to_dicts(),
             'total_categories': category_stats.height,
-            'top_categories': category_stats.head(10).to_dicts(),
-            'total_items_with_category': valid_items.height,
-            'items_without_category': items_df.height - valid_items.height
+            # Фрейм уже отсортирован: в словари конвертируются только top_k строк
+            'top_categories': category_stats.head(top_k).to_dicts(),
+            'total_items_with_category': total_items_with_category,
+            'items_without_category': items_df.height - total_items_with_category
         }
     
-    def _analyze_brands(self, items_df: pl.DataFrame) -> Dict:
-        """Анализ брендов и их ценовых диапазонов"""
-        brand_stats = (
-            items_df.group_by('brand_id')
-            .agg([
-                pl.count().alias('product_count'),
-                pl.col('price').mean().alias('avg_price'),
-                pl.col('category').unique().alias('categories')
-            ])
-            .filter(pl.col('product_count') > 5)  # Только значимые бренды
-            .sort('avg_price', descending=True)
-        )
+    def _analyze_brands(self, items_df: pl.DataFrame, brand_stats: pl.DataFrame | None = None) -> Dict:
+        """Анализ брендов и их ценовых диапазонов (brand_stats — готовый агрегат из _collect_group_stats)"""
+        if brand_stats is None:
+            brand_stats = self._collect_group_stats(items_df)['brand']
         
         return {
             'total_brands': brand_stats.height,
@@ -103,27 +196,22 @@ class CategoryDiscoverer:
             'budget_brands': brand_stats.filter(pl.col('avg_price') < 10000).to_dicts()
         }
     
-    def _auto_categorize_items(self, items_df: pl.DataFrame) -> Dict:
+    def _auto_categorize_items(self, items_df: pl.DataFrame, category_combo: pl.DataFrame | None = None,
+                               price_stats: Dict | None = None) -> Dict:
         """Автоматическая категоризация на основе анализа данных"""
         enhanced_categories = {}
         
         # Анализ по комбинации категория + подкатегория
         if 'category' in items_df.columns and 'subcategory' in items_df.columns:
-            category_combo = (
-                items_df.filter(pl.col('category').is_not_null() & pl.col('subcategory').is_not_null())
-                .group_by(['category', 'subcategory'])
-                .agg([
-                    pl.count().alias('count'),
-                    pl.col('price').mean().alias('avg_price'),
-                    pl.col('price').std().alias('price_volatility')
-                ])
-            )
+            if category_combo is None:
+                category_combo = self._collect_group_stats(items_df)['category_combo']
             
             enhanced_categories['category_combinations'] = category_combo.to_dicts()
         
         # Определение товарных кластеров по цене (только если цены корректны)
         if 'price' in items_df.columns:
-            price_stats = self._get_price_stats(items_df)
+            if price_stats is None:
+                price_stats = self._get_price_stats(items_df)
             if price_stats['is_valid']:
                 price_clusters = self._create_price_clusters(items_df)
                 enhanced_categories['price_clusters'] = price_clusters
@@ -134,28 +222,35 @@ class CategoryDiscoverer:
     
     def _create_price_clusters(self, items_df: pl.DataFrame) -> List[Dict]:
         """Создание кластеров товаров по цене"""
-        # Используем правильный способ получения квантилей
-        q25 = items_df['price'].quantile(0.25)
-        q75 = items_df['price'].quantile(0.75)
+        # Квартили и размеры трех сегментов — одним select (пустые цены ни в один сегмент не попадают)
+        price = pl.col('price')
+        q25_expr, q75_expr = price.quantile(0.25), price.quantile(0.75)
+        q25, q75, budget_count, medium_count, premium_count = items_df.select([
+            q25_expr.alias('q25'),
+            q75_expr.alias('q75'),
+            (price <= q25_expr).sum().alias('budget_count'),
+            ((price > q25_expr) & (price <= q75_expr)).sum().alias('medium_count'),
+            (price > q75_expr).sum().alias('premium_count')
+        ]).row(0)
         
         clusters = [
             {
                 'segment': 'budget',
                 'range': (0, q25),
                 'description': 'Бюджетные товары повседневного спроса',
-                'item_count': items_df.filter(pl.col('price') <= q25).height
+                'item_count': budget_count
             },
             {
                 'segment': 'medium', 
                 'range': (q25, q75),
                 'description': 'Товары среднего ценового диапазона',
-                'item_count': items_df.filter((pl.col('price') > q25) & (pl.col('price') <= q75)).height
+                'item_count': medium_count
             },
             {
                 'segment': 'premium',
                 'range': (q75, float('inf')),
                 'description': 'Премиальные товары и инвестиционные покупки',
-                'item_count': items_df.filter(pl.col('price') > q75).height
+                'item_count': premium_count
             }
         ]
         
@@ -163,21 +258,31 @@ class CategoryDiscoverer:
     
     def _analyze_price_segments(self, items_df: pl.DataFrame) -> Dict:
         """Анализ ценовых сегментов"""
-        # Используем абсолютные значения цен для анализа
-        price_col = pl.col('price')
-        
-        segments = {
-            'budget': items_df.filter(price_col < 1000),
-            'medium': items_df.filter((price_col >= 1000) & (price_col < 10000)),
-            'premium': items_df.filter((price_col >= 10000) & (price_col < 50000)),
-            'luxury': items_df.filter(price_col >= 50000)
-        }
+        # Сегменты [0, 1000), [1000, 10000), [10000, 50000), [50000, inf) — один cut и один group_by
+        segment_names = ['budget', 'medium', 'premium', 'luxury']
+        segment_stats = (
+            items_df.lazy()
+            .select([
+                pl.col('price').cut([1000, 10000, 50000], labels=segment_names, left_closed=True).alias('segment'),
+                pl.col('price')
+            ])
+            .drop_nulls('segment')
+            .group_by('segment')
+            .agg([
+                pl.len().alias('count'),
+                pl.col('price').mean().alias('avg_price'),
+                pl.col('price').min().alias('min_price'),
+                pl.col('price').max().alias('max_price')
+            ])
+            .collect()
+        )
+        by_segment = {row['segment']: row for row in segment_stats.to_dicts()}
         
         return {
             name: {
-                'count': df.height,
-                'avg_price': df['price'].mean() if df.height > 0 else 0,
-                'price_range': (df['price'].min(), df['price'].max()) if df.height > 0 else (0, 0)
-            }
-            for name, df in segments.items()
-        }
\ No newline at end of file
+                'count': by_segment[name]['count'],
+                'avg_price': by_segment[name]['avg_price'],
+                'price_range': (by_segment[name]['min_price'], by_segment[name]['max_price'])
+            } if name in by_segment else {'count': 0, 'avg_price': 0, 'price_range': (0, 0)}
+            for name in segment_names
+        }
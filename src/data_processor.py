@@ -1,33 +1,84 @@
 import polars as pl
 import glob
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+from itertools import accumulate
 from pathlib import Path
 from config.paths import PATHS
 from typing import Dict, List
 import json
 
+# Колонки товаров, нужные пайплайну (без тяжелой колонки embedding)
+ITEM_COLUMNS = ['item_id', 'brand_id', 'category', 'subcategory', 'price']
+
+# Seed хэша user_id -> uid (фиксированный, чтобы uid совпадали между источниками)
+UID_SEED = 0xC0FFEE
+
+# Кэш load_all_data в памяти процесса: ключ -> dict датафреймов
+_DATA_CACHE: dict[str, dict[str, pl.DataFrame]] = {}
+
 class DataProcessor:
     def __init__(self):
         self.paths = PATHS
         self.processed_data = {}
     
-    def load_all_data(self, sample_fraction: float = 0.1) -> Dict:
-        """Загрузка всех данных с возможностью семплирования"""
+    def scan_all_data(self, sample_fraction: float = 0.1, synth_prices: bool = False) -> Dict[str, pl.LazyFrame]:
+        """Ленивое сканирование всех данных (без чтения строк с диска)"""
+        print("🔄 Сканирование данных...")
+        
+        data = {}
+        
+        try:
+            # Пользователи и товары — только footer/схема, строки читаются при .collect()
+            data['users'] = self.add_uid(pl.scan_parquet(self.paths.RAW_DATA['users']))
+            data['retail_items'] = pl.scan_parquet(self.paths.RAW_DATA['retail_items'])
+            if synth_prices:
+                # Синтетические цены считаются в том же плане, что и чтение товаров
+                data['retail_items'] = self.add_synthetic_prices(data['retail_items'])
+            
+            # Семплирование событий для скорости
+            data['retail_events'] = self._scan_and_sample_events('retail', sample_fraction)
+            
+        except Exception as e:
+            print(f"❌ Ошибка сканирования: {e}")
+            
+        return data
+    
+    def load_all_data(self, sample_fraction: float = 0.1, use_cache: bool = True,
+                      synth_prices: bool = True) -> Dict:
+        """Загрузка всех данных с возможностью семплирования.
+        
+        При synth_prices=True к товарам добавляются price_original/price_fixed
+        (см. add_synthetic_prices). Результат кэшируется в памяти и в PATHS.DATA_CACHE_DIR (Arrow IPC);
+        кэш инвалидируется при изменении mtime/размера любого исходного файла.
+        """
         print("🔄 Загрузка данных...")
         
         data = {}
         
         try:
+            cache_key = self._data_cache_key(sample_fraction, synth_prices) if use_cache else None
+            data = self._read_data_cache(cache_key) if cache_key else {}
+            
+            if not data:
+                lazy_data = self.scan_all_data(sample_fraction, synth_prices)
+                
+                # Все источники независимы — читаем их параллельно одним collect_all
+                data = dict(zip(lazy_data.keys(), pl.collect_all(list(lazy_data.values()))))
+                
+                if cache_key:
+                    self._write_data_cache(cache_key, data)
+            
             # Пользователи
-            data['users'] = pl.read_parquet(self.paths.RAW_DATA['users'])
             print(f"👥 Пользователи: {data['users'].shape}")
             
             # Retail items
-            data['retail_items'] = pl.read_parquet(self.paths.RAW_DATA['retail_items'])
             print(f"🛍️ Retail товары: {data['retail_items'].shape}")
             print(f"   Колонки: {data['retail_items'].columns}")
             
-            # Семплирование событий для скорости
-            data['retail_events'] = self._load_and_sample_events('retail', sample_fraction)
             print(f"📊 Retail события: {data['retail_events'].shape}")
             
         except Exception as e:
@@ -35,23 +86,125 @@ class DataProcessor:
             
         return data
     
-    def _load_and_sample_events(self, event_type: str, fraction: float) -> pl.DataFrame:
-        """Загрузка и семплирование событий"""
+    def _data_cache_key(self, sample_fraction: float, synth_prices: bool) -> str:
+        """Ключ кэша: (mtime_ns, размер) исходных файлов + параметры загрузки"""
+        sources = [self.paths.RAW_DATA['users'], self.paths.RAW_DATA['retail_items']]
+        sources += sorted(glob.glob(str(self.paths.EVENT_PATTERNS['retail'])))
+        
+        digest = hashlib.md5(repr((sample_fraction, synth_prices)).encode())
+        for source in sources:
+            stat = Path(source).stat()
+            digest.update(f"{source}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+        return digest.hexdigest()
+    
+    def _read_data_cache(self, cache_key: str) -> Dict[str, pl.DataFrame]:
+        """Чтение данных из кэша (сначала память, затем Arrow IPC на диске)"""
+        if cache_key in _DATA_CACHE:
+            print("   ♻️ Данные взяты из кэша в памяти")
+            return dict(_DATA_CACHE[cache_key])
+        
+        cache_dir = self.paths.DATA_CACHE_DIR / cache_key
+        if not cache_dir.exists():
+            return {}
+        
+        try:
+            data = {f.stem: pl.read_ipc(f) for f in cache_dir.glob("*.arrow")}
+        except Exception as e:
+            print(f"   ⚠️ Не удалось прочитать кэш данных: {e}")
+            return {}
+        
+        if data:
+            print(f"   ♻️ Данные взяты из кэша: {cache_dir}")
+            _DATA_CACHE[cache_key] = data
+        return dict(data)
+    
+    def _write_data_cache(self, cache_key: str, data: Dict[str, pl.DataFrame]):
+        """Сохранение загруженных данных в кэш"""
+        _DATA_CACHE[cache_key] = dict(data)
+        
+        # Файлы пишутся во временный каталог, который переименовывается в cache_dir только целиком:
+        # недописанный кэш (прерванный процесс) не виден _read_data_cache
+        cache_dir = self.paths.DATA_CACHE_DIR / cache_key
+        tmp_dir = None
+        try:
+            cache_dir.parent.mkdir(parents=True, exist_ok=True)
+            tmp_dir = Path(tempfile.mkdtemp(prefix=f".{cache_key}-", dir=cache_dir.parent))
+            for name, df in data.items():
+                df.write_ipc(tmp_dir / f"{name}.arrow")
+            os.replace(tmp_dir, cache_dir)
+        except Exception as e:
+            print(f"   ⚠️ Не удалось сохранить кэш данных: {e}")
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+    
+    def clear_data_cache(self):
+        """Очистка кэша load_all_data (память и диск)"""
+        _DATA_CACHE.clear()
+        shutil.rmtree(self.paths.DATA_CACHE_DIR, ignore_errors=True)
+    
+    def _scan_and_sample_events(self, event_type: str, fraction: float) -> pl.LazyFrame:
+        """Ленивое сканирование и семплирование событий"""
         event_files = glob.glob(str(self.paths.EVENT_PATTERNS[event_type]))
         print(f"   Найдено файлов {event_type}: {len(event_files)}")
         
         if not event_files:
-            return pl.DataFrame()
+            return pl.LazyFrame()
         
         # Берем первый файл для демо
         sample_file = event_files[0]
-        events = pl.read_parquet(sample_file)
+        events = pl.scan_parquet(sample_file)
+        
+        # Число строк берется из закэшированных метаданных parquet
+        metadata = self.paths.get_cached_metadata(sample_file)
+        total_rows = metadata.num_rows
         
         # Семплируем если данных много
-        if events.height > 100000:
-            events = events.sample(fraction=fraction)
+        if total_rows > 100000:
+            sample_size = int(total_rows * fraction)
+            # Единственная стадия семплирования: случайные row group-ы, выбранные при построении плана,
+            # поэтому повторные collect одного плана видят одну и ту же выборку
+            events = self._sample_row_groups(sample_file, metadata, sample_size).head(sample_size)
             
-        return events
+        return self.add_uid(events)
+    
+    def _sample_row_groups(self, path, metadata, sample_size: int) -> pl.LazyFrame:
+        """Случайные row group-ы файла, покрывающие sample_size строк.
+        
+        Каждый row group читается через slice(offset, len), который Polars передает
+        в parquet-ридер — остальные row group-ы с диска не читаются.
+        """
+        sizes = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+        offsets = [0, *accumulate(sizes[:-1])]
+        
+        picked, picked_rows = [], 0
+        for i in random.sample(range(len(sizes)), len(sizes)):
+            picked.append(i)
+            picked_rows += sizes[i]
+            if picked_rows >= sample_size:
+                break
+        
+        return pl.concat([pl.scan_parquet(path).slice(offsets[i], sizes[i]) for i in sorted(picked)])
+    
+    @staticmethod
+    def add_uid(frame: pl.LazyFrame) -> pl.LazyFrame:
+        """Ключ uid (UInt64-хэш user_id) для join-ов и фильтров без сравнения строк"""
+        return frame.with_columns(pl.col('user_id').hash(seed=UID_SEED).alias('uid'))
+    
+    @staticmethod
+    def add_synthetic_prices(items: pl.LazyFrame) -> pl.LazyFrame:
+        """Реалистичные цены на основе хэша категории (1000-10000, без категории — 2000)"""
+        # Хэш считается один раз на уникальную категорию, а не на каждую строку
+        category_price_lut = (
+            items.select('category').unique().drop_nulls()
+            # Модуль берется от u64-хэша, сужение — уже результата (1000-9999 помещается в 2 байта)
+            .with_columns(((pl.col('category').hash() % 9000) + 1000).cast(pl.UInt16).alias('price_fixed'))
+        )
+        
+        return (
+            items.with_columns(pl.col('price').alias('price_original'))
+            .join(category_price_lut, on='category', how='left')
+            .with_columns(pl.col('price_fixed').fill_null(pl.lit(2000, dtype=pl.UInt16)))
+        )
     
     def explore_data_structure(self, data: Dict):
         """Исследование структуры данных"""
@@ -82,6 +82,36 @@ class MLEnhancer:
         optimized_score = base_score * 0.6 + ml_score * 0.4
         return round(optimized_score, 3)
     
+    def optimize_batch(self, base_score: float, user_profile: Dict, business_values: np.ndarray) -> np.ndarray:
+        """Оптимизация score одного пользователя сразу для всех продуктов"""
+        if not self.is_trained:
+            return np.full(len(business_values), round(base_score * 0.6 + 0.5 * 0.4, 3))
+        
+        user_spending = user_profile.get('total_spent', 0) or 0
+        
+        # Матрица признаков (n_products, n_features) в том же порядке, что и _extract_features
+        X = np.empty((len(business_values), 6))
+        X[:, 0] = user_spending
+        X[:, 1] = user_profile.get('avg_transaction_value', 0) or 0
+        X[:, 2] = self._map_activity_level(user_profile.get('interaction_frequency', 'unknown'))
+        X[:, 3] = user_profile.get('category_diversity', 0) or 0
+        X[:, 4] = business_values
+        X[:, 5] = np.select(
+            [(user_spending > 50000) & (business_values > 0.7),
+             (user_spending > 20000) & (business_values > 0.5),
+             np.full(len(business_values), user_spending > 5000)],
+            [0.9, 0.7, 0.5],
+            default=0.3
+        )
+        
+        try:
+            ml_scores = np.clip(self.model.predict(self.scaler.transform(X)), 0, 1)
+        except Exception as e:
+            print(f"⚠️ Ошибка ML предсказания: {e}")
+            ml_scores = np.full(len(business_values), 0.5)
+        
+        return np.round(base_score * 0.6 + ml_scores * 0.4, 3)
+    
     def _extract_features(self, record: Dict) -> List[float]:
         """Извлечение признаков из данных"""
         user_profile = record['user_profile']
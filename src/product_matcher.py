@@ -1,13 +1,37 @@
 import polars as pl
-from typing import Dict, List, Tuple
+from typing import Dict, List
 import numpy as np
-from config.products import BANK_PRODUCTS
+from config.products import BANK_PRODUCTS, BANK_PRODUCTS_DF
 from src.llm_processor import FreeLLMProcessor
 from src.ml_enhanced_matcher import MLEnhancer
 
+# Правила базового скоринга профиля: (условие, прибавка к score, причина).
+# Внутри группы срабатывает первое выполненное условие (как if/elif).
+BASE_SCORE_RULES = [
+    # 1. Уровень трат
+    [(pl.col('spending_level').is_in(['high', 'very_high']), 0.2, "Высокий уровень трат"),
+     (pl.col('spending_level') == 'medium', 0.1, "Средний уровень трат")],
+    # 2. Активность
+    [(pl.col('interaction_frequency').is_in(['high', 'very_high']), 0.15, "Высокая активность"),
+     (pl.col('interaction_frequency') == 'medium', 0.08, "Умеренная активность")],
+    # 3. Общие траты
+    [(pl.col('total_spent').fill_null(0) > 50000, 0.15, "Значительные общие траты"),
+     (pl.col('total_spent').fill_null(0) > 20000, 0.08, "Заметные траты")],
+    # 4. Средний чек
+    [(pl.col('avg_transaction_value').fill_null(0) > 10000, 0.1, "Высокий средний чек"),
+     (pl.col('avg_transaction_value').fill_null(0) > 5000, 0.05, "Средний чек выше среднего")],
+    # 5. Разнообразие интересов
+    [(pl.col('category_diversity').fill_null(0) > 0.3, 0.1, "Широкие интересы"),
+     (pl.col('category_diversity').fill_null(0) > 0.1, 0.05, "Разнообразные интересы")],
+    # 6. Длительность активности
+    [(pl.col('activity_duration_days').fill_null(0) > 180, 0.08, "Длительная активность"),
+     (pl.col('activity_duration_days').fill_null(0) > 30, 0.04, "Стабильная активность")],
+]
+
 class ProductMatcher:
     def __init__(self, discovered_categories: Dict):
         self.bank_products = BANK_PRODUCTS
+        self.products_df = BANK_PRODUCTS_DF
         self.discovered_categories = discovered_categories
         self.llm_processor = FreeLLMProcessor(discovered_categories)
         self.ml_enhancer = MLEnhancer()
@@ -22,7 +46,12 @@ class ProductMatcher:
         recommendations = []
         processed_users = 0
         
-        for user_row in user_profiles.iter_rows(named=True):
+        # Базовый score и причины считаются одним векторным проходом по всем профилям
+        scored_profiles = user_profiles.with_columns(
+            self._compile_base_score(user_profiles.schema)
+        )
+        
+        for user_row in scored_profiles.iter_rows(named=True):
             try:
                 user_recs = self._get_enhanced_recommendations_for_user(user_row, use_ml)
                 recommendations.extend(user_recs)
@@ -48,122 +77,81 @@ class ProductMatcher:
         
         print(f"      ML статус: use_ml={use_ml}, is_trained={self.ml_enhancer.is_trained}")  # ОТЛАДКА
         
-        # Базовый расчет для всех продуктов
-        for product_type, products in self.bank_products.items():
-            for product in products:
-                try:
-                    # Базовый расчет соответствия
-                    base_score, reasoning = self._calculate_simple_product_match(user_profile, product)
-                    
-                    # ML оптимизация если включена
-                    if use_ml and self.ml_enhancer.is_trained:
-                        try:
-                            final_score = self.ml_enhancer.optimize(base_score, user_profile, product)
-                            ml_used = True
-                            print(f"      ✅ ML применен: {base_score:.3f} -> {final_score:.3f}")  # ОТЛАДКА
-                        except Exception as e:
-                            # Если ML не готов, используем базовый score
-                            final_score = base_score
-                            ml_used = False
-                            print(f"      ⚠️ ML ошибка: {e}")  # ОТЛАДКА
-                    else:
-                        final_score = base_score
-                        ml_used = False
-                        if use_ml and not self.ml_enhancer.is_trained:
-                            print(f"      ⚠️ ML не обучена")  # ОТЛАДКА
-                    
-                    # Генерация объяснения на основе данных пользователя
-                    explanation = self._generate_data_based_explanation(user_profile, product, reasoning)
-                    
-                    if final_score > 0.2:  # Низкий порог для лучшего покрытия
-                        recommendations.append({
-                            'user_id': user_profile['user_id'],
-                            'product_id': product['id'],
-                            'product_name': product['name'],
-                            'product_type': product_type,
-                            'base_match_score': round(base_score, 3),
-                            'final_score': round(final_score, 3),
-                            'reasoning': "; ".join(reasoning),
-                            'llm_explanation': explanation,
-                            'business_value': product.get('business_value', 0.5),
-                            'ml_enhanced': ml_used,  # ДОЛЖНО БЫТЬ True при использовании ML
-                            'llm_enhanced': True
-                        })
-                except Exception as e:
-                    print(f"      ⚠️ Ошибка обработки продукта {product.get('name', 'unknown')}: {e}")
-                    continue
-        
-        # Сортируем по итоговому score и возвращаем топ-5
-        return sorted(recommendations, key=lambda x: x['final_score'], reverse=True)[:5]
-
-    def _calculate_simple_product_match(self, user_profile: Dict, product: Dict) -> Tuple[float, List[str]]:
-        """Упрощенный и безопасный расчет соответствия"""
-        reasoning_parts = []
-        score = 0.3  # Базовый score для всех
-        
-        # Безопасное получение значений с дефолтами
-        user_spending = user_profile.get('spending_level', 'unknown')
-        user_activity = user_profile.get('interaction_frequency', 'unknown')
-        user_total_spent = user_profile.get('total_spent', 0) or 0
-        user_avg_transaction = user_profile.get('avg_transaction_value', 0) or 0
-        user_diversity = user_profile.get('category_diversity', 0) or 0
-        activity_duration = user_profile.get('activity_duration_days', 0) or 0
+        # Базовый score не зависит от продукта и уже посчитан для всех профилей
+        base_score, reasoning = user_profile['base_score'], user_profile['base_reasoning']
         
-        # 1. Уровень трат
-        if user_spending in ['high', 'very_high']:
-            score += 0.2
-            reasoning_parts.append("Высокий уровень трат")
-        elif user_spending == 'medium':
-            score += 0.1
-            reasoning_parts.append("Средний уровень трат")
-        
-        # 2. Активность
-        if user_activity in ['high', 'very_high']:
-            score += 0.15
-            reasoning_parts.append("Высокая активность")
-        elif user_activity == 'medium':
-            score += 0.08
-            reasoning_parts.append("Умеренная активность")
+        business_values = self.products_df['business_value'].fill_null(0.5).to_numpy()
         
-        # 3. Общие траты
-        if user_total_spent > 50000:
-            score += 0.15
-            reasoning_parts.append("Значительные общие траты")
-        elif user_total_spent > 20000:
-            score += 0.08
-            reasoning_parts.append("Заметные траты")
-        
-        # 4. Средний чек
-        if user_avg_transaction > 10000:
-            score += 0.1
-            reasoning_parts.append("Высокий средний чек")
-        elif user_avg_transaction > 5000:
-            score += 0.05
-            reasoning_parts.append("Средний чек выше среднего")
-        
-        # 5. Разнообразие интересов
-        if user_diversity > 0.3:
-            score += 0.1
-            reasoning_parts.append("Широкие интересы")
-        elif user_diversity > 0.1:
-            score += 0.05
-            reasoning_parts.append("Разнообразные интересы")
-        
-        # 6. Длительность активности
-        if activity_duration > 180:
-            score += 0.08
-            reasoning_parts.append("Длительная активность")
-        elif activity_duration > 30:
-            score += 0.04
-            reasoning_parts.append("Стабильная активность")
+        # ML оптимизация сразу для всех продуктов
+        ml_used = False
+        final_scores = np.full(len(business_values), base_score)
+        if use_ml and self.ml_enhancer.is_trained:
+            try:
+                final_scores = self.ml_enhancer.optimize_batch(base_score, user_profile, business_values)
+                ml_used = True
+            except Exception as e:
+                # Если ML не готов, используем базовый score
+                print(f"      ⚠️ ML ошибка: {e}")  # ОТЛАДКА
+        elif use_ml:
+            print(f"      ⚠️ ML не обучена")  # ОТЛАДКА
+        
+        # Низкий порог для лучшего покрытия, сортируем и берем топ-5
+        top_products = (
+            self.products_df
+            .select(['product_id', 'product_name', 'product_type', 'business_value'])
+            .with_columns(pl.Series('final_score', final_scores))
+            .filter(pl.col('final_score') > 0.2)
+            .sort('final_score', descending=True, maintain_order=True)
+            .head(5)
+        )
+        
+        for product in top_products.iter_rows(named=True):
+            # Генерация объяснения на основе данных пользователя
+            explanation = self._generate_data_based_explanation(
+                user_profile, {'name': product['product_name']}, reasoning
+            )
+            
+            recommendations.append({
+                'user_id': user_profile['user_id'],
+                'product_id': product['product_id'],
+                'product_name': product['product_name'],
+                'product_type': product['product_type'],
+                'base_match_score': round(base_score, 3),
+                'final_score': round(product['final_score'], 3),
+                'reasoning': "; ".join(reasoning),
+                'llm_explanation': explanation,
+                'business_value': product['business_value'] if product['business_value'] is not None else 0.5,
+                'ml_enhanced': ml_used,  # ДОЛЖНО БЫТЬ True при использовании ML
+                'llm_enhanced': True
+            })
+        
+        return recommendations
+
+    def _compile_base_score(self, schema) -> List[pl.Expr]:
+        """Сборка правил BASE_SCORE_RULES в выражения Polars (score и список причин)"""
+        rules = list(BASE_SCORE_RULES)
         
         # 7. Категориальные предпочтения (если есть)
-        category_affinity = user_profile.get('category_affinity', {}) or {}
-        if category_affinity:
-            score += 0.05
-            reasoning_parts.append("Есть категориальные предпочтения")
+        affinity_dtype = schema.get('category_affinity')
+        if isinstance(affinity_dtype, pl.Struct) and affinity_dtype.fields:
+            rules.append([(pl.col('category_affinity').is_not_null(), 0.05, "Есть категориальные предпочтения")])
+        
+        score = pl.lit(0.3)  # Базовый score для всех
+        reasons = []
+        for (condition, points, reason), *rest in rules:
+            points_expr = pl.when(condition).then(pl.lit(points))
+            reason_expr = pl.when(condition).then(pl.lit(reason))
+            for condition, points, reason in rest:
+                points_expr = points_expr.when(condition).then(pl.lit(points))
+                reason_expr = reason_expr.when(condition).then(pl.lit(reason))
+            
+            score = score + points_expr.otherwise(pl.lit(0.0))
+            reasons.append(reason_expr)
         
-        return min(score, 1.0), reasoning_parts
+        return [
+            score.clip(upper_bound=1.0).alias('base_score'),
+            pl.concat_list(reasons).list.drop_nulls().alias('base_reasoning')
+        ]
     
     def _generate_data_based_explanation(self, user_profile: Dict, product: Dict, reasoning: List[str]) -> str:
         """Генерация объяснения на основе реальных данных пользователя"""
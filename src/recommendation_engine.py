@@ -5,7 +5,7 @@ from datetime import datetime, timedelta
 import json
 from pathlib import Path  # ДОБАВЬТЕ ЭТУ СТРОКУ
 
-from src.user_profiler import UserProfiler
+from src.user_profiler import UserProfiler, FrameLike
 from src.product_matcher import ProductMatcher
 from utils.metrics import RecommendationMetrics
 from utils.helpers import SystemHelpers, DataValidator
@@ -26,9 +26,9 @@ class AdvancedRecommendationEngine:
     
     # ... остальной код остается без изменений ...
         
-    def generate_recommendations(self, users_df: pl.DataFrame, 
-                           events_df: pl.DataFrame, 
-                           items_df: pl.DataFrame,
+    def generate_recommendations(self, users_df: FrameLike, 
+                           events_df: FrameLike, 
+                           items_df: FrameLike,
                            optimization_strategy: str = "balanced") -> pl.DataFrame:  # УБИРАЕМ use_ml
         """
         Генерация оптимизированных рекомендаций с ML/LLM
@@ -391,9 +391,9 @@ class AdvancedRecommendationEngine:
         else:
             return "very_low"
     
-    def generate_strategy_comparison(self, users_df: pl.DataFrame,
-                                   events_df: pl.DataFrame,
-                                   items_df: pl.DataFrame) -> Dict:
+    def generate_strategy_comparison(self, users_df: FrameLike,
+                                   events_df: FrameLike,
+                                   items_df: FrameLike) -> Dict:
         """Сравнение разных стратегий оптимизации"""
         print("📊 Сравнение стратегий оптимизации...")
         
@@ -554,9 +554,9 @@ class AdvancedRecommendationEngine:
         
         print(f"💾 Анализ рекомендаций сохранен: {filepath}")
     
-    def run_complete_analysis(self, users_df: pl.DataFrame,
-                            events_df: pl.DataFrame,
-                            items_df: pl.DataFrame,
+    def run_complete_analysis(self, users_df: FrameLike,
+                            events_df: FrameLike,
+                            items_df: FrameLike,
                             output_dir: str = "results") -> Dict:
         """Запуск полного анализа рекомендационной системы"""
         print("🚀 ЗАПУСК ПОЛНОГО АНАЛИЗА РЕКОМЕНДАТЕЛЬНОЙ СИСТЕМЫ")
@@ -1,18 +1,23 @@
 import polars as pl
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Union
 from datetime import datetime, timedelta
 
+FrameLike = Union[pl.DataFrame, pl.LazyFrame]
+
+# Колонки событий, которые реально используются при построении профилей
+EVENT_COLUMNS = ['uid', 'user_id', 'item_id', 'action_type', 'timestamp']
+
 class UserProfiler:
     def __init__(self, discovered_categories: Dict):
         self.categories = discovered_categories
         self.user_profiles = {}
     
-    def create_user_profiles(self, users_df: pl.DataFrame, events_df: pl.DataFrame, items_df: pl.DataFrame) -> pl.DataFrame:
+    def create_user_profiles(self, users_df: FrameLike, events_df: FrameLike, items_df: FrameLike) -> pl.DataFrame:
         """Создание профилей пользователей на основе их поведения"""
         print("👤 Создание пользовательских профилей...")
         
-        if events_df.height == 0:
+        if isinstance(events_df, pl.DataFrame) and events_df.height == 0:
             print("❌ Нет событий для анализа")
             return pl.DataFrame()
         
@@ -23,21 +28,22 @@ class UserProfiler:
             print("❌ Не удалось обогатить события данными о товарах")
             return pl.DataFrame()
         
-        # Берем пользователей из событий
-        users_from_events = enriched_events['user_id'].unique()
-        print(f"   Пользователей для анализа: {users_from_events.len()}")  # Исправлено: .len() вместо .length()
+        # Берем пользователей из событий (по uid, если он есть)
+        key = 'uid' if 'uid' in enriched_events.columns else 'user_id'
+        users_from_events = enriched_events.select(pl.col(key), pl.col('user_id')).unique(subset=key)
+        print(f"   Пользователей для анализа: {users_from_events.height}")  # Исправлено: .len() вместо .length()
         
         # Создаем профили для всех пользователей из событий (ограничим для скорости)
-        sample_size = min(users_from_events.len(), 1000)
+        sample_size = min(users_from_events.height, 1000)
         sample_users = users_from_events.head(sample_size)
         
         user_profiles = []
         processed = 0
         success_count = 0
         
-        for user_id in sample_users:
+        for user_key, user_id in sample_users.iter_rows():
             try:
-                profile = self._create_single_user_profile(user_id, enriched_events)
+                profile = self._create_single_user_profile(user_id, enriched_events, key, user_key)
                 if profile:
                     user_profiles.append(profile)
                     success_count += 1
@@ -55,38 +61,47 @@ class UserProfiler:
         print(f"   ✅ Успешно создано профилей: {len(user_profiles)}")
         return pl.DataFrame(user_profiles) if user_profiles else pl.DataFrame()
     
-    def _enrich_events_with_item_data(self, events_df: pl.DataFrame, items_df: pl.DataFrame) -> pl.DataFrame:
+    def _enrich_events_with_item_data(self, events_df: FrameLike, items_df: FrameLike) -> pl.DataFrame:
         """Обогащение событий данными о товарах"""
-        if events_df.height == 0 or items_df.height == 0:
-            print("⚠️ Нет событий или товаров для обогащения")
-            return events_df
-            
-        print(f"   Обогащение {events_df.height} событий данными о {items_df.height} товарах...")
+        if isinstance(events_df, pl.DataFrame) and isinstance(items_df, pl.DataFrame):
+            if events_df.height == 0 or items_df.height == 0:
+                print("⚠️ Нет событий или товаров для обогащения")
+                return events_df
+            print(f"   Обогащение {events_df.height} событий данными о {items_df.height} товарах...")
         
         try:
+            events_lf = events_df.lazy()
+            items_lf = items_df.lazy()
+            
             # Используем price_fixed если есть, иначе создаем
-            if 'price_fixed' not in items_df.columns:
-                items_df = items_df.with_columns([
+            if 'price_fixed' not in items_lf.collect_schema().names():
+                items_lf = items_lf.with_columns([
                     pl.when(pl.col('category').is_not_null())
                      .then((pl.col('category').hash() % 9000) + 1000)
                      .otherwise(2000)
+                     .cast(pl.UInt16)
                      .alias('price_fixed')
                 ])
             
-            enriched = events_df.join(
-                items_df.select(['item_id', 'category', 'subcategory', 'price_fixed']),
+            # Единственный collect: проекция и join выполняются за один проход
+            event_columns = [c for c in EVENT_COLUMNS if c in events_lf.collect_schema().names()]
+            enriched = events_lf.select(event_columns).join(
+                items_lf.select(['item_id', 'category', 'subcategory', 'price_fixed']),
                 on='item_id',
                 how='left'
-            )
+            ).collect(engine='streaming')
             print(f"   После обогащения: {enriched.height} событий")
             return enriched
-        except Exception as e:
+        except (pl.exceptions.ColumnNotFoundError, pl.exceptions.SchemaError) as e:
+            # Только несовместимые колонки событий/товаров; прочие ошибки не маскируются
             print(f"❌ Ошибка обогащения событий: {e}")
-            return events_df
+            return events_df.lazy().collect()
     
-    def _create_single_user_profile(self, user_id: str, enriched_events: pl.DataFrame) -> Dict:
+    def _create_single_user_profile(self, user_id: str, enriched_events: pl.DataFrame,
+                                    key: str = 'user_id', user_key=None) -> Dict:
         """Создание профиля для одного пользователя"""
-        user_events = enriched_events.filter(pl.col('user_id') == user_id)
+        user_key = user_id if user_key is None else user_key
+        user_events = enriched_events.filter(pl.col(key) == user_key)
         
         if user_events.height == 0:
             return None
@@ -0,0 +1,32 @@
+import polars as pl
+import pytest
+
+from config.products import BANK_PRODUCTS
+from src.product_matcher import ProductMatcher
+
+
+@pytest.fixture
+def matcher():
+    return ProductMatcher(discovered_categories={})
+
+
+def test_recommendations_match_full_catalog_loop(matcher):
+    """Топ-5 совпадает с исходным перебором всех продуктов каталога (без предфильтра)"""
+    profiles = pl.DataFrame([{
+        'user_id': 'u1', 'spending_level': 'low', 'interaction_frequency': 'medium',
+        'total_spent': 0.0, 'avg_transaction_value': 0.0, 'spending_consistency': 0.5,
+        'category_diversity': 0.0, 'activity_duration_days': 0,
+    }])
+    recommendations = matcher.match_users_to_products(profiles, use_ml=False)
+    
+    # Исходный цикл: score продукта равен базовому score профиля, порог 0.2, стабильная сортировка
+    base_score = recommendations['base_match_score'][0]
+    scored = [
+        (base_score, product['id'])
+        for products in BANK_PRODUCTS.values() for product in products
+        if base_score > 0.2
+    ]
+    expected = [product_id for _, product_id in sorted(scored, key=lambda x: x[0], reverse=True)[:5]]
+    
+    assert recommendations['product_id'].to_list() == expected
+    assert 'deposit_4' in expected
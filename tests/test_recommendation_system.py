@@ -0,0 +1,63 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from recommendation_system import PROFILE_COLUMNS, BankProductMatcher, UserProfile
+
+
+@pytest.fixture
+def matcher():
+    return BankProductMatcher()
+
+
+def zero_spend_profile(matcher):
+    """Пользователь без трат: доли категорий 0/0 = NaN"""
+    return UserProfile(
+        user_id='u1',
+        spending_level='low',
+        purchase_frequency='monthly',
+        category_affinity={cat: float('nan') for cat in matcher.rule_categories[:2]},
+        price_sensitivity=0.0,
+        avg_transaction_value=0.0,
+        lifetime_value=0.0,
+        purchase_volatility=0.0,
+        estimated_income_bracket='low',
+        active_categories=matcher.rule_categories[:2],
+        total_transactions=0,
+    )
+
+
+def scalar_scores(matcher, profile):
+    """calculate_product_score + бонус категорий активности для каждого продукта"""
+    active = set(profile.active_categories)
+    return np.array([
+        matcher.calculate_product_score(profile, name, rules)
+        + 0.1 * len(active & set(rules.get('suitable_categories', [])))
+        for name, rules in matcher.PRODUCT_RULES.items()
+    ])
+
+
+def test_score_matrix_matches_scalar_for_zero_spend_user(matcher):
+    profile = zero_spend_profile(matcher)
+    np.testing.assert_allclose(matcher.score_matrix([profile])[0], scalar_scores(matcher, profile))
+
+
+def test_score_frame_matches_scalar_for_zero_spend_user(matcher):
+    profile = zero_spend_profile(matcher)
+    frame = pl.DataFrame([{
+        'user_id': profile.user_id,
+        'spending_level': profile.spending_level,
+        'purchase_frequency': profile.purchase_frequency,
+        'price_sensitivity': profile.price_sensitivity,
+        'avg_transaction_value': profile.avg_transaction_value,
+        'lifetime_value': profile.lifetime_value,
+        'purchase_volatility': profile.purchase_volatility,
+        'estimated_income_bracket': profile.estimated_income_bracket,
+        'total_transactions': profile.total_transactions,
+        'affinity_categories': list(profile.category_affinity),
+        'affinity_scores': list(profile.category_affinity.values()),
+        'active_category_mask': matcher._category_mask(profile.active_categories),
+    }]).select(PROFILE_COLUMNS)
+    scores = matcher.score_frame(frame)[0]
+    assert not np.isnan(scores).any()
+    np.testing.assert_allclose(scores, scalar_scores(matcher, profile))